@@ -1,32 +1,83 @@
 """
-Cluster class for Project 3
+Cluster class for Project 3, a compact variant storing interned county ids,
+as well as a NumPy-backed container for storing large sets of clusters as contiguous arrays
 """
 
 import math
+import numpy as np
+import instrumentation
+
+# relative tolerance (with respect to the second moment of a cluster) used
+# when verifying an error computed from the moments against the exact one
+MOMENT_ERROR_TOLERANCE = 1e-9
+
+# interned county ids: _COUNTY_IDS maps a FIPS code to its id and _COUNTY_FIPS an id back to its code
+_COUNTY_IDS = {}
+_COUNTY_FIPS = []
+
+
+def add_moments(moments1, moments2):
+    """
+    Compute the moments of the union of two disjoint sets of counties
+    (unknown if the moments of either set are unknown)
+    """
+    if moments1 is None or moments2 is None:
+        return None
+    return tuple(moment1 + moment2 for moment1, moment2 in zip(moments1, moments2))
+
+
+def county_id(fips_code):
+    """
+    Get the interned integer id of a FIPS code (ids are only valid within a process)
+    """
+    idx = _COUNTY_IDS.get(fips_code)
+    if idx is None:
+        idx = _COUNTY_IDS[fips_code] = len(_COUNTY_FIPS)
+        _COUNTY_FIPS.append(fips_code)
+    return idx
+
+
+def county_fips(idx):
+    """
+    Get the FIPS code of an interned county id
+    """
+    return _COUNTY_FIPS[idx]
 
 
 class Cluster:
     """
     Class for creating and merging clusters of counties
+
+    Besides its center, a cluster keeps the moments of its counties
+    (sum p, sum p * x, sum p * y, sum p * (x^2 + y^2), weighted by population p),
+    which are enough to compute its error without looking at the counties.
     """
+    __slots__ = ('_fips_codes', '_horiz_center', '_vert_center', '_total_population',
+                 '_averaged_risk', '_moments')
     
-    def __init__(self, fips_codes, horiz_pos, vert_pos, population, risk):
+    def __init__(self, fips_codes, horiz_pos, vert_pos, population, risk, moments=None):
         """
         Create a cluster based the models a set of counties' data
+        If moments are not given, a cluster of at most one county is assumed to lie
+        at its center, while the moments of a larger cluster are left unknown
         """
         self._fips_codes = fips_codes
         self._horiz_center = horiz_pos
         self._vert_center = vert_pos
         self._total_population = population
         self._averaged_risk = risk
+        if moments is None and len(fips_codes) <= 1:
+            moments = (population, population * horiz_pos, population * vert_pos,
+                       population * (horiz_pos ** 2 + vert_pos ** 2))
+        self._moments = moments
         
         
     def __repr__(self):
         """
         String representation assuming the module is "alg_cluster".
         """
-        rep = "alg_cluster.Cluster("
-        rep += str(self._fips_codes) + ", "
+        rep = "alg_cluster." + type(self).__name__ + "("
+        rep += str(self.fips_codes()) + ", "
         rep += str(self._horiz_center) + ", "
         rep += str(self._vert_center) + ", "
         rep += str(self._total_population) + ", "
@@ -39,6 +90,12 @@ class Cluster:
         Get the cluster's set of FIPS codes
         """
         return self._fips_codes
+
+    def num_counties(self):
+        """
+        Get the number of counties in the cluster
+        """
+        return len(self._fips_codes)
     
     def horiz_center(self):
         """
@@ -63,6 +120,13 @@ class Cluster:
         Get the averaged risk for the cluster
         """
         return self._averaged_risk
+
+    def moments(self):
+        """
+        Get the population-weighted moments of the cluster's counties as a tuple
+        (sum p, sum p * x, sum p * y, sum p * (x^2 + y^2)), or None if they are unknown
+        """
+        return self._moments
    
         
     def copy(self):
@@ -70,7 +134,7 @@ class Cluster:
         Return a copy of a cluster
         """
         copy_cluster = Cluster(set(self._fips_codes), self._horiz_center, self._vert_center,
-                               self._total_population, self._averaged_risk)
+                               self._total_population, self._averaged_risk, self._moments)
         return copy_cluster
 
 
@@ -90,10 +154,12 @@ class Cluster:
         
         Note that this method mutates self
         """
-        if len(other_cluster.fips_codes()) == 0:
+        if other_cluster.num_counties() == 0:
             return self
         else:
-            self._fips_codes.update(set(other_cluster.fips_codes()))
+            if instrumentation.ACTIVE_REPORT is not None:
+                instrumentation.ACTIVE_REPORT.count('cluster.merges')
+            self._add_counties(other_cluster)
  
             # compute weights for averaging
             self_weight = float(self._total_population)                        
@@ -106,14 +172,53 @@ class Cluster:
             self._vert_center = self_weight * self._vert_center + other_weight * other_cluster.vert_center()
             self._horiz_center = self_weight * self._horiz_center + other_weight * other_cluster.horiz_center()
             self._averaged_risk = self_weight * self._averaged_risk + other_weight * other_cluster.averaged_risk()
+
+            self._moments = add_moments(self._moments, other_cluster.moments())
             return self
 
-    def cluster_error(self, data_table):
+    def _add_counties(self, other_cluster):
         """
-        Input: data_table is the original table of cancer data used in creating the cluster.
+        Add the counties of another cluster to the cluster's counties
+        """
+        self._fips_codes.update(other_cluster.fips_codes())
+
+    def cluster_error(self, data_table=None, verify=False):
+        """
+        Input: data_table is the original table of cancer data used in creating the cluster
+        (only needed if the moments of the cluster are unknown or verify is set).
         
         Output: The error as the sum of the square of the distance from each county
         in the cluster to the cluster center (weighted by its population)
+
+        The error is computed in O(1) from the moments when they are known. With verify set,
+        it is also computed exactly from data_table and a ValueError is raised on a mismatch.
+        """
+        report = instrumentation.ACTIVE_REPORT
+        moments = self.moments()
+        if moments is not None:
+            if report is not None:
+                report.count('cluster.errors_from_moments')
+            pop_sum, horiz_sum, vert_sum, square_sum = moments
+            moment_error = max(0.0, square_sum - 2 * (self._horiz_center * horiz_sum + self._vert_center * vert_sum) +
+                                    (self._horiz_center ** 2 + self._vert_center ** 2) * pop_sum)
+            if not verify:
+                return moment_error
+        if data_table is None:
+            raise ValueError('A data table is needed to compute the error of this cluster')
+
+        if report is not None:
+            report.count('cluster.exact_errors')
+        total_error = self.exact_cluster_error(data_table)
+        if moments is not None and \
+           abs(moment_error - total_error) > MOMENT_ERROR_TOLERANCE * max(abs(square_sum), 1.0):
+            raise ValueError(f'Cluster error from moments = {moment_error} does not match exact error = {total_error}')
+        return total_error
+
+    def exact_cluster_error(self, data_table):
+        """
+        Input: data_table is the original table of cancer data used in creating the cluster.
+        
+        Output: The error of the cluster computed from the data of each of its counties
         """
         # Build hash table to accelerate error computation
         fips_to_line = {line[0]:line_idx for line_idx, line in enumerate (data_table)}
@@ -128,4 +233,426 @@ class Cluster:
             total_error += (singleton_distance ** 2) * singleton_cluster.total_population()
         return total_error
 
-        
\ No newline at end of file
+
+class CompactCluster(Cluster):
+    """
+    Cluster storing its counties as interned integer ids (see county_id)
+
+    The ids are held in a tree of nested tuples: merging two compact clusters joins
+    their trees in O(1) instead of copying sets of FIPS codes. The trees are never
+    mutated, so copies of a cluster share them. The clusters merged into one another
+    are assumed to have disjoint counties, as for the moments.
+    """
+    __slots__ = ('_members', '_num_counties')
+
+    def __init__(self, fips_codes, horiz_pos, vert_pos, population, risk, moments=None):
+        """
+        Create a cluster based the models a set of counties' data (see Cluster)
+        """
+        members = tuple(county_id(fips_code) for fips_code in fips_codes)
+        super().__init__(members, horiz_pos, vert_pos, population, risk, moments)
+        self._fips_codes = None
+        self._members = members
+        self._num_counties = len(members)
+
+    @classmethod
+    def from_cluster(cls, cluster):
+        """
+        Create a compact cluster holding the same counties and data as another cluster
+        """
+        if isinstance(cluster, CompactCluster):
+            return cluster.copy()
+        return cls(cluster.fips_codes(), cluster.horiz_center(), cluster.vert_center(),
+                   cluster.total_population(), cluster.averaged_risk(), cluster.moments())
+
+    def __reduce__(self):
+        """
+        Pickle the cluster by its FIPS codes, as interned ids are only valid within a process
+        """
+        return (CompactCluster, (self.fips_codes(), self._horiz_center, self._vert_center,
+                                 self._total_population, self._averaged_risk, self._moments))
+
+
+    def county_ids(self):
+        """
+        Generate the interned ids of the cluster's counties
+        """
+        stack = [self._members]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, tuple):
+                stack.extend(node)
+            else:
+                yield node
+
+    def fips_codes(self):
+        """
+        Get the cluster's set of FIPS codes (built on every call)
+        """
+        return {_COUNTY_FIPS[idx] for idx in self.county_ids()}
+
+    def num_counties(self):
+        """
+        Get the number of counties in the cluster
+        """
+        return self._num_counties
+
+
+    def copy(self):
+        """
+        Return a copy of a cluster (sharing the immutable tree of county ids)
+        """
+        copy_cluster = CompactCluster((), self._horiz_center, self._vert_center,
+                                      self._total_population, self._averaged_risk)
+        copy_cluster._members = self._members
+        copy_cluster._num_counties = self._num_counties
+        copy_cluster._moments = self._moments
+        return copy_cluster
+
+    def _add_counties(self, other_cluster):
+        """
+        Add the counties of another cluster to the cluster's counties
+        """
+        if isinstance(other_cluster, CompactCluster):
+            other_members = other_cluster._members
+        else:
+            other_members = tuple(county_id(fips_code) for fips_code in other_cluster.fips_codes())
+        self._members = (self._members, other_members) if self._num_counties else other_members
+        self._num_counties += other_cluster.num_counties()
+
+
+class ClusterSet:
+    """
+    Container storing the centers, populations and risks of a set of clusters
+    in contiguous arrays (one row per cluster), together with the FIPS codes
+    of the counties and the label of the cluster each county belongs to.
+
+    Indexing the set returns lightweight views that behave like Cluster objects.
+    Merging two views marks the absorbed row as inactive instead of deleting it,
+    so row indices stay valid for the lifetime of the set.
+    """
+
+    def __init__(self, horiz_pos, vert_pos, population, risk, fips_codes=(), labels=None):
+        """
+        Create a set of clusters from arrays of their parameters
+        fips_codes are the codes of all the counties in the set and labels[idx] is the row
+        of the cluster that fips_codes[idx] belongs to (by default county idx forms cluster idx)
+        """
+        self._horiz_center = np.array(horiz_pos, dtype=float)
+        self._vert_center = np.array(vert_pos, dtype=float)
+        self._total_population = np.array(population, dtype=np.int64)
+        self._averaged_risk = np.array(risk, dtype=float)
+        self._fips_codes = np.array(list(fips_codes), dtype=str)
+        if labels is None:
+            labels = np.arange(len(self._fips_codes))
+        self._labels = np.array(labels, dtype=np.intp)
+        self._active = np.ones(len(self._horiz_center), dtype=bool)
+
+    @classmethod
+    def from_data_table(cls, data_table):
+        """
+        Create a set of singleton clusters, one for each line of a table of county data
+        """
+        columns = list(zip(*data_table)) if len(data_table) else [[]] * 5
+        return cls(columns[1], columns[2], columns[3], columns[4], fips_codes=columns[0])
+
+    @classmethod
+    def from_clusters(cls, cluster_list):
+        """
+        Create a set holding the same clusters as a list of Cluster objects
+        """
+        fips_codes, labels = [], []
+        for cluster_idx, cluster in enumerate(cluster_list):
+            cluster_fips = cluster.fips_codes()
+            fips_codes.extend(cluster_fips)
+            labels.extend([cluster_idx] * len(cluster_fips))
+        return cls([cluster.horiz_center() for cluster in cluster_list],
+                   [cluster.vert_center() for cluster in cluster_list],
+                   [cluster.total_population() for cluster in cluster_list],
+                   [cluster.averaged_risk() for cluster in cluster_list],
+                   fips_codes, labels)
+
+
+    def __len__(self):
+        """
+        Get the number of rows (including inactive ones)
+        """
+        return len(self._horiz_center)
+
+    def __getitem__(self, idx):
+        """
+        Get a view of the cluster stored in row idx
+        """
+        if not -len(self) <= idx < len(self):
+            raise IndexError(f'Cluster index out of range = {idx}')
+        return ClusterView(self, idx % len(self))
+
+    def __iter__(self):
+        """
+        Iterate over views of the active clusters
+        """
+        for idx in self.active_rows():
+            yield ClusterView(self, idx)
+
+    def __repr__(self):
+        """
+        String representation assuming the module is "alg_cluster".
+        """
+        return "alg_cluster.ClusterSet(" + str(self.to_clusters()) + ")"
+
+
+    def horiz_centers(self):
+        """
+        Get the array of horizontal centers
+        """
+        return self._horiz_center
+
+    def vert_centers(self):
+        """
+        Get the array of vertical centers
+        """
+        return self._vert_center
+
+    def total_populations(self):
+        """
+        Get the array of total populations
+        """
+        return self._total_population
+
+    def averaged_risks(self):
+        """
+        Get the array of averaged risks
+        """
+        return self._averaged_risk
+
+    def fips_codes(self):
+        """
+        Get the array of FIPS codes of all the counties in the set
+        """
+        return self._fips_codes
+
+    def labels(self):
+        """
+        Get the array of rows of the clusters every county belongs to
+        """
+        return self._labels
+
+    def active_rows(self):
+        """
+        Get the array of rows whose clusters have not been merged into another one
+        """
+        return np.flatnonzero(self._active)
+
+    def members(self, idx):
+        """
+        Get the array of positions of the counties that belong to the cluster in row idx
+        """
+        return np.flatnonzero(self._labels == idx)
+
+
+    def to_clusters(self):
+        """
+        Return a list of independent Cluster objects for the active clusters
+        """
+        return [view.copy() for view in self]
+
+    def compact(self):
+        """
+        Return a new set holding only the active clusters
+        """
+        rows = self.active_rows()
+        new_rows = np.full(len(self), -1, dtype=np.intp)
+        new_rows[rows] = np.arange(len(rows))
+        return ClusterSet(self._horiz_center[rows], self._vert_center[rows], self._total_population[rows],
+                          self._averaged_risk[rows], self._fips_codes,
+                          new_rows[self._labels] if len(self._labels) else self._labels)
+
+    def merge_rows(self, idx1, idx2):
+        """
+        Merge the cluster in row idx2 into the cluster in row idx1
+        using the same weighting as Cluster.merge_clusters
+
+        Note that this method mutates the set and deactivates row idx2
+        """
+        self._active[idx2] = False
+        members = self._labels == idx2
+        # an empty row leaves the cluster in row idx1 unchanged, as with merge_clusters
+        if not members.any():
+            return
+        if instrumentation.ACTIVE_REPORT is not None:
+            instrumentation.ACTIVE_REPORT.count('cluster_set.merges')
+        self._labels[members] = idx1
+        self._merge_values(idx1, self._horiz_center[idx2], self._vert_center[idx2],
+                           self._total_population[idx2], self._averaged_risk[idx2])
+
+    def add_cluster(self, idx, cluster):
+        """
+        Merge a Cluster object that is not stored in the set into the cluster in row idx
+        Counties of the set listed by the cluster are moved to row idx, new ones are appended
+
+        Note that this method mutates the set
+        """
+        other_fips = cluster.fips_codes()
+        if len(other_fips) == 0:
+            return
+        known = np.isin(self._fips_codes, list(other_fips))
+        self._labels[known] = idx
+        new_fips = set(other_fips).difference(self._fips_codes[known].tolist())
+        self._fips_codes = np.concatenate([self._fips_codes, np.array(sorted(new_fips), dtype=str)])
+        self._labels = np.concatenate([self._labels, np.full(len(new_fips), idx, dtype=np.intp)])
+        self._merge_values(idx, cluster.horiz_center(), cluster.vert_center(),
+                           cluster.total_population(), cluster.averaged_risk())
+
+    def _merge_values(self, idx, horiz_pos, vert_pos, population, risk):
+        """
+        Update the center, population and risk of row idx after merging another cluster into it
+        """
+        self_weight = float(self._total_population[idx])
+        other_weight = float(population)
+        total_population = int(self._total_population[idx]) + int(population)
+        self_weight /= total_population
+        other_weight /= total_population
+        self._total_population[idx] = total_population
+        self._vert_center[idx] = self_weight * float(self._vert_center[idx]) + other_weight * float(vert_pos)
+        self._horiz_center[idx] = self_weight * float(self._horiz_center[idx]) + other_weight * float(horiz_pos)
+        self._averaged_risk[idx] = self_weight * float(self._averaged_risk[idx]) + other_weight * float(risk)
+
+
+    def cluster_errors(self, data_table):
+        """
+        Input: data_table is the original table of cancer data used in creating the clusters.
+
+        Output: Array whose entry idx is the error of the cluster in row idx, computed
+        in the same way as Cluster.cluster_error
+        """
+        errors = np.zeros(len(self))
+        if instrumentation.ACTIVE_REPORT is not None:
+            instrumentation.ACTIVE_REPORT.count('cluster_set.error_passes')
+        if len(self._fips_codes) == 0:
+            return errors
+        fips_to_line = {line[0]:line_idx for line_idx, line in enumerate(data_table)}
+        lines = np.array([fips_to_line[fips] for fips in self._fips_codes.tolist()], dtype=np.intp)
+        columns = list(zip(*data_table))
+        horiz = np.array(columns[1], dtype=float)[lines]
+        vert = np.array(columns[2], dtype=float)[lines]
+        population = np.array(columns[3], dtype=float)[lines]
+
+        # weighted squared distance from every county to the center of its cluster
+        labeled = self._labels >= 0
+        labels = self._labels[labeled]
+        vert_dist = self._vert_center[labels] - vert[labeled]
+        horiz_dist = self._horiz_center[labels] - horiz[labeled]
+        county_errors = (vert_dist ** 2 + horiz_dist ** 2) * population[labeled]
+        return np.bincount(labels, weights=county_errors, minlength=len(self))
+
+    def distortion(self, data_table):
+        """
+        Compute the total error of the active clusters
+        """
+        return float(self.cluster_errors(data_table)[self._active].sum())
+
+
+class ClusterView(Cluster):
+    """
+    Lightweight Cluster whose data is stored in a row of a ClusterSet
+    """
+    __slots__ = ('_cluster_set', '_idx')
+
+    def __init__(self, cluster_set, idx):
+        """
+        Create a view of the cluster stored in row idx of cluster_set
+        """
+        self._cluster_set = cluster_set
+        self._idx = idx
+
+
+    def __repr__(self):
+        """
+        String representation assuming the module is "alg_cluster".
+        """
+        return repr(self.copy())
+
+    def cluster_set(self):
+        """
+        Get the set the cluster is stored in
+        """
+        return self._cluster_set
+
+    def row(self):
+        """
+        Get the row of the set the cluster is stored in
+        """
+        return self._idx
+
+
+    def fips_codes(self):
+        """
+        Get the cluster's set of FIPS codes
+        """
+        return set(self._cluster_set.fips_codes()[self._cluster_set.members(self._idx)].tolist())
+
+    def num_counties(self):
+        """
+        Get the number of counties in the cluster
+        """
+        return len(self._cluster_set.members(self._idx))
+
+    def horiz_center(self):
+        """
+        Get the averged horizontal center of cluster
+        """
+        return float(self._cluster_set.horiz_centers()[self._idx])
+
+    def vert_center(self):
+        """
+        Get the averaged vertical center of the cluster
+        """
+        return float(self._cluster_set.vert_centers()[self._idx])
+
+    def total_population(self):
+        """
+        Get the total population for the cluster
+        """
+        return int(self._cluster_set.total_populations()[self._idx])
+
+    def averaged_risk(self):
+        """
+        Get the averaged risk for the cluster
+        """
+        return float(self._cluster_set.averaged_risks()[self._idx])
+
+
+    def moments(self):
+        """
+        Get the moments of the cluster (unknown for a view, whose error is
+        computed from the counties)
+        """
+        return None
+
+    def distance(self, other_cluster):
+        """
+        Compute the Euclidean distance between two clusters
+        """
+        vert_dist = self.vert_center() - other_cluster.vert_center()
+        horiz_dist = self.horiz_center() - other_cluster.horiz_center()
+        return math.sqrt(vert_dist ** 2 + horiz_dist ** 2)
+
+    def copy(self):
+        """
+        Return a copy of a cluster as an independent Cluster object
+        """
+        return Cluster(self.fips_codes(), self.horiz_center(), self.vert_center(),
+                       self.total_population(), self.averaged_risk())
+
+    def merge_clusters(self, other_cluster):
+        """
+        Merge one cluster into another
+        If other_cluster is a view of the same set, its row is deactivated
+
+        Note that this method mutates the underlying set
+        """
+        if isinstance(other_cluster, ClusterView) and other_cluster.cluster_set() is self._cluster_set:
+            self._cluster_set.merge_rows(self._idx, other_cluster.row())
+        else:
+            self._cluster_set.add_cluster(self._idx, other_cluster)
+        return self
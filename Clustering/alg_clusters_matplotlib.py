@@ -5,6 +5,7 @@ import os
 import math
 import matplotlib.pyplot as plt
 import matplotlib.cbook as cbook
+from matplotlib.collections import LineCollection
 
 
 def circle_area(pop):
@@ -14,9 +15,13 @@ def circle_area(pop):
     return math.pi * pop / (200.0 ** 2)
 
 
-def plot_clusters(data_table, cluster_list, draw_centers = False):
+def plot_clusters(data_table, cluster_list, draw_centers = False, output_path = None):
     """
     Create a plot of clusters of counties
+
+    Every cluster is drawn with a single scatter and all the lines from the centers
+    to the counties with a single LineCollection. If output_path is given, the plot
+    is written to that PNG file instead of being shown, so no display is needed
     """
     # Define colors for clusters.  Display a max of 16 clusters.
     COLORS = ['Aqua', 'Yellow', 'Blue', 'Fuchsia', 'Black', 'Green', 'Lime', 'Maroon', \
@@ -26,8 +31,8 @@ def plot_clusters(data_table, cluster_list, draw_centers = False):
     for line_idx in range(len(data_table)):
         fips_to_line[data_table[line_idx][0]] = line_idx
      
-    # Generate path to the map
-    image_path = os.getcwd() + r'\Clustering\USA_Counties.png'
+    # Generate path to the map (stored next to this module)
+    image_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'USA_Counties.png')
 
     # Load map image
     with cbook.get_sample_data(image_path) as image_file:
@@ -38,41 +43,35 @@ def plot_clusters(data_table, cluster_list, draw_centers = False):
     DPI = 60.0
     xinch = xpixels / DPI
     yinch = ypixels / DPI
-    plt.figure(figsize=(xinch,yinch))
+    figure = plt.figure(figsize=(xinch,yinch))
     implot = plt.imshow(map_img)
    
-    # draw the counties colored by cluster on the map
-    if not draw_centers:
-        for cluster_idx in range(len(cluster_list)):
-            cluster = cluster_list[cluster_idx]
-            cluster_color = COLORS[cluster_idx % len(COLORS)]
-            for fips_code in cluster.fips_codes():
-                line = data_table[fips_to_line[fips_code]]
-                plt.scatter(x = [line[1]], y = [line[2]], s =  circle_area(line[3]), lw = 1,
-                            facecolors = cluster_color, edgecolors = cluster_color)
-
-    # add cluster centers and lines from center to counties            
-    else:
-        for cluster_idx in range(len(cluster_list)):
-            cluster = cluster_list[cluster_idx]
-            cluster_color = COLORS[cluster_idx % len(COLORS)]
-            for fips_code in cluster.fips_codes():
-                line = data_table[fips_to_line[fips_code]]
-                plt.scatter(x = [line[1]], y = [line[2]], s =  circle_area(line[3]), lw = 1,
-                            facecolors = cluster_color, edgecolors = cluster_color, zorder = 1)
-        for cluster_idx in range(len(cluster_list)):
-            cluster = cluster_list[cluster_idx]
-            cluster_color = COLORS[cluster_idx % len(COLORS)]
+    # draw the counties colored by cluster on the map, one scatter per cluster
+    segments, segment_colors = [], []
+    for cluster_idx in range(len(cluster_list)):
+        cluster = cluster_list[cluster_idx]
+        cluster_color = COLORS[cluster_idx % len(COLORS)]
+        lines = [data_table[fips_to_line[fips_code]] for fips_code in cluster.fips_codes()]
+        if not lines:
+            continue
+        plt.scatter(x = [line[1] for line in lines], y = [line[2] for line in lines],
+                    s = [circle_area(line[3]) for line in lines], lw = 1,
+                    facecolors = cluster_color, edgecolors = cluster_color, zorder = 1)
+        if draw_centers:
             cluster_center = (cluster.horiz_center(), cluster.vert_center())
-            for fips_code in cluster.fips_codes():
-                line = data_table[fips_to_line[fips_code]]
-                plt.plot( [cluster_center[0], line[1]],[cluster_center[1], line[2]], cluster_color, lw=1, zorder = 2)
-        for cluster_idx in range(len(cluster_list)):
-            cluster = cluster_list[cluster_idx]
-            cluster_color = COLORS[cluster_idx % len(COLORS)]
-            cluster_center = (cluster.horiz_center(), cluster.vert_center())
-            cluster_pop = cluster.total_population()
-            plt.scatter(x = [cluster_center[0]], y = [cluster_center[1]], s =  circle_area(cluster_pop), lw = 2,
-                        facecolors = "none", edgecolors = "black", zorder = 3)
+            segments.extend([cluster_center, (line[1], line[2])] for line in lines)
+            segment_colors.extend([cluster_color] * len(lines))
+
+    # add cluster centers and lines from center to counties
+    if draw_centers:
+        plt.gca().add_collection(LineCollection(segments, colors = segment_colors, linewidths = 1, zorder = 2))
+        plt.scatter(x = [cluster.horiz_center() for cluster in cluster_list],
+                    y = [cluster.vert_center() for cluster in cluster_list],
+                    s = [circle_area(cluster.total_population()) for cluster in cluster_list], lw = 2,
+                    facecolors = "none", edgecolors = "black", zorder = 3)
 
-    plt.show()
\ No newline at end of file
+    if output_path is None:
+        plt.show()
+    else:
+        figure.savefig(output_path, format = 'png')
+        plt.close(figure)
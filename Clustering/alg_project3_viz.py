@@ -3,27 +3,89 @@ Creating and visualizing clusters of county-based cancer risk data
 using three different clustering algorithms
 """
 
+import io
 import math
+import os
 import urllib.request
+import data_cache
 from alg_cluster import Cluster
 from project_3 import kmeans_clustering, hierarchical_clustering
 from alg_clusters_matplotlib import plot_clusters
+from result_cache import cached_clustering
 
 
-def load_data_table(data_url):
+def load_data_table(data_url, use_cache=True, refresh=False):
     """
     Import a table of county-based cancer risk data
     from a csv format file
+
+    Unless use_cache is False, the table is kept in the local data cache
+    (see data_cache) and only downloaded the first time or when refresh is set
+    """
+    if use_cache:
+        return data_cache.cached_data_table(data_url, download_data_table, refresh=refresh)
+    return download_data_table(data_url)
+
+
+def download_data_table(data_url):
+    """
+    Helper function that downloads and parses a csv format table, bypassing the cache
+    """
+    data_table = list(iter_data_table(data_url))
+
+    print ("Loaded", len(data_table), "data points")
+
+    return data_table
+
+
+def iter_data_table(data_source, as_clusters=False):
     """
-    data_file = urllib.request.urlopen(data_url)
-    data_text = str(data_file.read(), "utf-8")
-    data_lines = data_text.split('\n')
+    Generate the rows [fips_code, horiz, vert, population, risk] of a table of
+    county-based cancer risk data from a csv format source, parsing one line at a time
+    so that memory use stays proportional to a single row
 
-    print ("Loaded", len(data_lines), "data points")
+    data_source is a URL (anything with a scheme, such as http:// or file://), a path
+    of a local file or an open file object (text or binary, left open). Blank lines are
+    skipped; a malformed line raises a ValueError giving its number. If as_clusters is
+    set, singleton Cluster objects are generated instead of rows
+    """
+    if isinstance(data_source, (str, os.PathLike)):
+        if isinstance(data_source, str) and '://' in data_source:
+            data_file = io.TextIOWrapper(urllib.request.urlopen(data_source), encoding="utf-8")
+        else:
+            data_file = open(data_source, encoding="utf-8")
+        with data_file:
+            yield from parse_data_lines(data_file, as_clusters)
+    elif isinstance(data_source, (io.RawIOBase, io.BufferedIOBase)):
+        text_file = io.TextIOWrapper(data_source, encoding="utf-8")
+        try:
+            yield from parse_data_lines(text_file, as_clusters)
+        finally:
+            # release the binary file, which the wrapper would otherwise close when collected
+            text_file.detach()
+    else:
+        yield from parse_data_lines(data_source, as_clusters)
 
-    data_tokens = [line.split(',') for line in data_lines]
-    return [[tokens[0], float(tokens[1]), float(tokens[2]), int(tokens[3]), float(tokens[4])] 
-            for tokens in data_tokens]
+
+def parse_data_lines(data_lines, as_clusters=False):
+    """
+    Helper generator that parses csv format lines of county data (see iter_data_table)
+    """
+    for line_num, line in enumerate(data_lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        tokens = line.split(',')
+        if len(tokens) != 5:
+            raise ValueError(f'Expected 5 fields on line {line_num}, got {len(tokens)}: {line!r}')
+        try:
+            row = [tokens[0], float(tokens[1]), float(tokens[2]), int(tokens[3]), float(tokens[4])]
+        except ValueError:
+            raise ValueError(f'Invalid value on line {line_num}: {line!r}') from None
+        if as_clusters:
+            yield Cluster(set([row[0]]), row[1], row[2], row[3], row[4])
+        else:
+            yield row
 
 
 def sequential_clustering(singleton_list, num_clusters, *_):
@@ -50,10 +112,14 @@ def sequential_clustering(singleton_list, num_clusters, *_):
     return cluster_list
                 
 
-def run_visualization(url):
+def run_visualization(url, result_cache=None, output_path=None):
     """
     Load a data table, compute a list of clusters and 
     visualize the results
+
+    Clusterings are reused through (result_cache), a ClusteringCache
+    (the default in-memory one if not given), when the same one is requested again.
+    If output_path is given, the map is written to that PNG file instead of being shown
     """
     # get the necessary parameters from user input
     print('\n<<< PARAMETER RETRIEVAL >>>\n')
@@ -94,11 +160,13 @@ def run_visualization(url):
     for line in data_table:
         singleton_list.append(Cluster(set([line[0]]), line[1], line[2], line[3], line[4]))
     
-    cluster_list = clust_funcs[clustering_type](singleton_list, num_clusters, num_iter)
+    cluster_list = cached_clustering(data_table, clustering_type, num_clusters, num_iter,
+                                     lambda: clust_funcs[clustering_type](singleton_list, num_clusters, num_iter),
+                                     result_cache)
     print (f"Displaying {len(cluster_list)} {clustering_type} clusters")
 
     # draw the clusters using matplotlib
-    plot_clusters(data_table, cluster_list, center_viz[cluster_centers])
+    plot_clusters(data_table, cluster_list, center_viz[cluster_centers], output_path)
 
     print("\n<<< Done >>>\n")
     
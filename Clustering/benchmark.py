@@ -0,0 +1,209 @@
+"""
+Headless benchmark suite for the clustering algorithms
+
+Times (slow_closest_pair), (fast_closest_pair), (hierarchical_clustering),
+(kmeans_clustering) and (compute_distortion) on seeded random inputs built
+with (gen_random_clusters), repeating every measurement and reporting the
+median and interquartile range of the run times as JSON.
+
+If run as a script, it can also compare the results against a saved baseline
+and exits with status 1 when a benchmark got slower than the allowed tolerance:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json --tolerance 0.25
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import sys
+from timeit import default_timer as timer
+from alg_cluster import Cluster
+from project_3 import slow_closest_pair, fast_closest_pair, hierarchical_clustering, kmeans_clustering
+from efficiency_distortion import gen_random_clusters, compute_distortion
+
+# numbers of clusters every benchmark runs with by default
+DEFAULT_SIZES = {'slow_closest_pair': [100, 400],
+                 'fast_closest_pair': [1000, 10000],
+                 'hierarchical_clustering': [500, 2000],
+                 'kmeans_clustering': [1000, 10000],
+                 'compute_distortion': [1000, 10000]}
+NUM_CLUSTERS = 15
+NUM_ITER = 5
+
+
+def gen_benchmark_table(num_points, seed):
+    '''
+    Creates a seeded data table of (num_points) counties whose
+    positions are given by (gen_random_clusters), with random
+    populations and risks
+    '''
+    random.seed(seed)
+    points = gen_random_clusters(num_points)
+    return [[str(idx), point.horiz_center(), point.vert_center(), random.randint(1, 100000), random.uniform(0, 1e-4)]
+            for idx, point in enumerate(points)]
+
+
+def singleton_clusters(data_table):
+    '''
+    Creates a list of singleton clusters, one for each line of (data_table)
+    '''
+    return [Cluster(set([line[0]]), line[1], line[2], line[3], line[4]) for line in data_table]
+
+
+def setup_closest_pair(data_table):
+    '''
+    Prepares the arguments of a closest pair function
+    '''
+    cluster_list = singleton_clusters(data_table)
+    cluster_list.sort(key = lambda cluster: cluster.horiz_center())
+    return (cluster_list,)
+
+
+def setup_hierarchical(data_table):
+    '''
+    Prepares the arguments of (hierarchical_clustering)
+    '''
+    return singleton_clusters(data_table), NUM_CLUSTERS
+
+
+def setup_kmeans(data_table):
+    '''
+    Prepares the arguments of (kmeans_clustering)
+    '''
+    return singleton_clusters(data_table), NUM_CLUSTERS, NUM_ITER
+
+
+def setup_distortion(data_table):
+    '''
+    Prepares the arguments of (compute_distortion) for a k-means clustering
+    whose moments are dropped, so the errors come from (data_table)
+    '''
+    cluster_list = [Cluster(cluster.fips_codes(), cluster.horiz_center(), cluster.vert_center(),
+                            cluster.total_population(), cluster.averaged_risk())
+                    for cluster in kmeans_clustering(singleton_clusters(data_table), NUM_CLUSTERS, NUM_ITER)]
+    return cluster_list, data_table
+
+
+# benchmarked function and setup preparing its arguments from a data table, by name
+BENCHMARKS = {'slow_closest_pair': (slow_closest_pair, setup_closest_pair),
+              'fast_closest_pair': (fast_closest_pair, setup_closest_pair),
+              'hierarchical_clustering': (hierarchical_clustering, setup_hierarchical),
+              'kmeans_clustering': (kmeans_clustering, setup_kmeans),
+              'compute_distortion': (compute_distortion, setup_distortion)}
+
+
+def time_trials(func, setup, data_table, num_trials):
+    '''
+    Measures (num_trials) run times of (func), each on fresh arguments
+    prepared by (setup) from (data_table) outside of the timing,
+    with the garbage collector paused as (timeit) does
+    '''
+    times = []
+    for _ in range(num_trials):
+        args = setup(data_table)
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = timer()
+            func(*args)
+            end = timer()
+        finally:
+            if gc_enabled:
+                gc.enable()
+        times.append(end - start)
+    return times
+
+
+def summarize(times):
+    '''
+    Computes the median and the interquartile range of run (times)
+    '''
+    if len(times) > 1:
+        lower, _, upper = statistics.quantiles(times, n = 4, method = 'inclusive')
+    else:
+        lower = upper = times[0]
+    return {'median': statistics.median(times), 'iqr': upper - lower, 'q1': lower, 'q3': upper,
+            'min': min(times), 'trials': len(times)}
+
+
+def run_benchmarks(names = None, sizes = None, num_trials = 7, seed = 0):
+    '''
+    Runs the benchmarks listed in (names) (all by default) for every
+    number of clusters in (sizes) (DEFAULT_SIZES by default),
+    on inputs seeded with (seed)
+
+    Returns a dictionary with the environment and, for every
+    benchmark "name/size", the summary of its run times
+    '''
+    results = {}
+    for name in names or list(BENCHMARKS):
+        func, setup = BENCHMARKS[name]
+        for size in sizes or DEFAULT_SIZES[name]:
+            data_table = gen_benchmark_table(size, seed)
+            results[f'{name}/{size}'] = summarize(time_trials(func, setup, data_table, num_trials))
+
+    return {'python': platform.python_version(), 'machine': platform.machine(),
+            'seed': seed, 'benchmarks': results}
+
+
+def compare_to_baseline(results, baseline, tolerance = 0.25):
+    '''
+    Compares the median run times of (results) with the ones of (baseline)
+    (benchmarks missing from either are skipped)
+
+    Returns a list of tuples (name, baseline_median, median, ratio)
+    for the benchmarks slower than the baseline by more than (tolerance)
+    '''
+    regressions = []
+    for name, summary in results['benchmarks'].items():
+        base_summary = baseline.get('benchmarks', {}).get(name)
+        if base_summary is None or base_summary['median'] <= 0:
+            continue
+        ratio = summary['median'] / base_summary['median']
+        if ratio > 1 + tolerance:
+            regressions.append((name, base_summary['median'], summary['median'], ratio))
+    return regressions
+
+
+def main(argv = None):
+    '''
+    Runs the benchmark suite from the command line and returns the exit status
+    '''
+    parser = argparse.ArgumentParser(description = 'Benchmark the clustering algorithms')
+    parser.add_argument('--bench', nargs = '+', choices = list(BENCHMARKS), help = 'benchmarks to run (all by default)')
+    parser.add_argument('--sizes', nargs = '+', type = int, help = 'numbers of clusters (per benchmark defaults otherwise)')
+    parser.add_argument('--trials', type = int, default = 7, help = 'repetitions of every measurement')
+    parser.add_argument('--seed', type = int, default = 0, help = 'seed of the random inputs')
+    parser.add_argument('--output', help = 'file to write the JSON results to (standard output otherwise)')
+    parser.add_argument('--baseline', help = 'JSON results to compare against')
+    parser.add_argument('--tolerance', type = float, default = 0.25,
+                        help = 'allowed relative slowdown of a median before failing')
+    args = parser.parse_args(argv)
+    if args.trials < 1:
+        parser.error(f'Invalid number of trials provided = {args.trials}')
+
+    results = run_benchmarks(args.bench, args.sizes, args.trials, args.seed)
+    if args.output:
+        with open(args.output, 'w', encoding = 'utf-8') as output_file:
+            json.dump(results, output_file, indent = 2)
+    else:
+        print(json.dumps(results, indent = 2))
+
+    if args.baseline:
+        with open(args.baseline, encoding = 'utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for name, base_median, median, ratio in regressions:
+            print(f'REGRESSION {name}: median {median:.6f}s vs baseline {base_median:.6f}s ({ratio:.2f}x)',
+                  file = sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
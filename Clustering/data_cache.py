@@ -0,0 +1,163 @@
+"""
+Local cache of county-based data tables
+
+A parsed table is stored as one binary NumPy file per column (FIPS codes,
+horizontal and vertical positions, populations and risks) in a directory
+named after the hash of its content, so the columns can be memory-mapped.
+An index maps every source URL to the content hash of its table, which lets
+repeated runs skip the download entirely and work without a network.
+Local files are indexed by their absolute path, modification time and size,
+so editing a file or naming it from another directory is never served stale.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import urllib.parse
+import urllib.request
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'alg_clustering')
+INDEX_NAME = 'index.json'
+COLUMNS = [('fips', str), ('horiz', np.float64), ('vert', np.float64),
+           ('population', np.int64), ('risk', np.float64)]
+
+
+def table_columns(data_table):
+    """
+    Convert a data table (a list of [fips_code, horiz, vert, population, risk] rows)
+    into a dictionary of column arrays
+    """
+    values = list(zip(*data_table)) if data_table else [[]] * len(COLUMNS)
+    return {name: np.array(column, dtype=dtype) for (name, dtype), column in zip(COLUMNS, values)}
+
+
+def columns_to_table(columns):
+    """
+    Convert a dictionary of column arrays back into a data table
+    """
+    return [list(row) for row in zip(*(columns[name].tolist() for name, _ in COLUMNS))]
+
+
+def content_hash(columns):
+    """
+    Compute the SHA-256 hash of the content of a dictionary of column arrays
+    """
+    digest = hashlib.sha256()
+    for name, _ in COLUMNS:
+        column = np.ascontiguousarray(columns[name])
+        digest.update(f'{name}:{column.dtype.str}:{column.shape}'.encode('utf-8'))
+        digest.update(column.tobytes())
+    return digest.hexdigest()
+
+
+def read_index(cache_dir):
+    """
+    Read the index mapping URLs to content hashes (empty if there is none)
+    """
+    try:
+        with open(os.path.join(cache_dir, INDEX_NAME), encoding='utf-8') as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_index(cache_dir, index):
+    """
+    Atomically replace the index mapping URLs to content hashes
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    file_desc, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.json')
+    with os.fdopen(file_desc, 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file, indent=1, sort_keys=True)
+    os.replace(temp_path, os.path.join(cache_dir, INDEX_NAME))
+
+
+def store_columns(columns, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Store a dictionary of column arrays in the cache (unless the same content is already there)
+    and return its content hash
+    """
+    table_hash = content_hash(columns)
+    table_dir = os.path.join(cache_dir, table_hash)
+    if not os.path.isdir(table_dir):
+        # write into a temporary directory first, so a table is either complete or absent
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(dir=cache_dir)
+        for name, _ in COLUMNS:
+            np.save(os.path.join(temp_dir, name + '.npy'), columns[name])
+        try:
+            os.rename(temp_dir, table_dir)
+        except OSError:
+            # another process stored the same table meanwhile
+            for name, _ in COLUMNS:
+                os.remove(os.path.join(temp_dir, name + '.npy'))
+            os.rmdir(temp_dir)
+    return table_hash
+
+
+def load_columns(table_hash, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Load the column arrays of a cached table as read-only memory maps
+
+    Raises OSError if the table is not in the cache
+    """
+    table_dir = os.path.join(cache_dir, table_hash)
+    return {name: np.load(os.path.join(table_dir, name + '.npy'), mmap_mode='r') for name, _ in COLUMNS}
+
+
+def source_key(data_url):
+    """
+    Get the key of the table found at (data_url) in the index
+
+    Network URLs are their own key. Local files (plain paths or file:// URLs) are keyed
+    by their absolute path, modification time and size; None is returned if the file
+    cannot be examined, in which case the table is not cached.
+    """
+    data_url = os.fspath(data_url)
+    if '://' in data_url:
+        parsed = urllib.parse.urlparse(data_url)
+        if parsed.scheme != 'file':
+            return data_url
+        data_url = urllib.request.url2pathname(parsed.path)
+    path = os.path.abspath(data_url)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f'{path}:{stat.st_mtime_ns}:{stat.st_size}'
+
+
+def cached_columns(data_url, loader, cache_dir=DEFAULT_CACHE_DIR, refresh=False):
+    """
+    Get the column arrays of the table found at (data_url)
+
+    The table is taken from the cache if the same source was loaded before (without any
+    network access); otherwise, or if refresh is set, it is loaded with loader(data_url),
+    stored under its content hash and recorded in the index under source_key(data_url).
+    """
+    key = source_key(data_url)
+    if key is None:
+        return table_columns(loader(data_url))
+
+    index = read_index(cache_dir)
+    if not refresh and key in index:
+        try:
+            return load_columns(index[key], cache_dir)
+        except OSError:
+            pass
+
+    table_hash = store_columns(table_columns(loader(data_url)), cache_dir)
+    if index.get(key) != table_hash:
+        index = read_index(cache_dir)
+        index[key] = table_hash
+        write_index(cache_dir, index)
+    return load_columns(table_hash, cache_dir)
+
+
+def cached_data_table(data_url, loader, cache_dir=DEFAULT_CACHE_DIR, refresh=False):
+    """
+    Get the table found at (data_url) as a list of rows, through the cache (see cached_columns)
+    """
+    return columns_to_table(cached_columns(data_url, loader, cache_dir, refresh))
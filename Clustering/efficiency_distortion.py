@@ -11,10 +11,16 @@ information on the total population of the county and its per-capita lifetime ca
 """
 import random
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
 from timeit import default_timer as timer
-from alg_cluster import Cluster
-from project_3 import slow_closest_pair, fast_closest_pair, hierarchical_clustering, kmeans_clustering
+from alg_cluster import Cluster, ClusterSet
+from project_3 import slow_closest_pair, fast_closest_pair, randomized_closest_pair, \
+                      hierarchical_merge_history, kmeans_clustering
 from alg_project3_viz import load_data_table
+from result_cache import ClusteringCache, cached_clustering, dataset_hash
+
+# data shared by the tasks of a sweep, set once in every worker process
+SWEEP_STATE = {}
 
 
 def gen_random_clusters(num_clusters):
@@ -27,14 +33,21 @@ def gen_random_clusters(num_clusters):
     return [Cluster(set([]), random.uniform(-1, 1), random.uniform(-1, 1), 0, 0) for _ in range(num_clusters)]
 
 
-def compute_distortion (cluster_list, data_table):
+def compute_distortion (cluster_list, data_table, verify = False):
     '''
     Computes a total distortion for a clustering
     specified as (cluster_list)
+
+    The error of every cluster is computed in O(1) from its moments
+    (if known); with (verify) set, each one is checked against 
+    the exact computation from (data_table)
     '''
+    if isinstance(cluster_list, ClusterSet):
+        return cluster_list.distortion(data_table)
+
     distortion = 0
     for cluster in cluster_list:
-        cluster_error = cluster.cluster_error(data_table)
+        cluster_error = cluster.cluster_error(data_table, verify)
         distortion += cluster_error
 
     return distortion
@@ -42,9 +55,9 @@ def compute_distortion (cluster_list, data_table):
 
 def fast_vs_brute (num_clusters):
     '''
-    Computes the running times for (slow_closest_pair)
-    and (fast_closest_pair) functions applied to
-    a random-generated list with (num_clusters) clusters
+    Computes the running times for (fast_closest_pair),
+    (slow_closest_pair) and (randomized_closest_pair) functions
+    applied to a random-generated list with (num_clusters) clusters
     '''
     #create a random list of clusters
     cluster_list = gen_random_clusters(num_clusters)
@@ -61,65 +74,146 @@ def fast_vs_brute (num_clusters):
     end = timer()    
     brute_time = end - start
 
-    return fast_time, brute_time
+    #measure the run time for the randomized func
+    start = timer()
+    _ = randomized_closest_pair(cluster_list)
+    end = timer()
+    randomized_time = end - start
+
+    return fast_time, brute_time, randomized_time
+
+
+def init_sweep_worker(data_table, reseed = True, cache_dir = None):
+    '''
+    Prepares a process for running sweep tasks: stores (data_table)
+    and its singleton clusters, and reseeds the random generator
+    so that forked workers do not share their random sequences.
+    The clusterings of the tasks are memoized in a result cache,
+    also stored in (cache_dir) unless it is None, which is kept
+    as long as the process prepares sweeps with the same (cache_dir)
+    '''
+    if reseed:
+        random.seed()
+    SWEEP_STATE['data_table'] = data_table
+    SWEEP_STATE['data_hash'] = dataset_hash(data_table) if data_table else None
+    SWEEP_STATE['singleton_list'] = [Cluster(set([line[0]]), line[1], line[2], line[3], line[4])
+                                     for line in data_table or []]
+    result_cache = SWEEP_STATE.get('result_cache')
+    if result_cache is None or result_cache.cache_dir() != cache_dir:
+        SWEEP_STATE['result_cache'] = ClusteringCache(cache_dir = cache_dir)
+
+
+def kmeans_distortion_task(num_clusters, num_iter):
+    '''
+    Sweep task computing the distortion of a k-means clustering
+    of the sweep data table with (num_clusters) clusters
+    '''
+    clusters_kmeans = cached_clustering(SWEEP_STATE['data_table'], 'kmeans', num_clusters, num_iter,
+                                        lambda: kmeans_clustering(SWEEP_STATE['singleton_list'], num_clusters, num_iter),
+                                        SWEEP_STATE['result_cache'], SWEEP_STATE['data_hash'])
+    return compute_distortion(clusters_kmeans, SWEEP_STATE['data_table'])
+
+
+def hierarchical_distortions_task(min_size, max_size):
+    '''
+    Sweep task computing the distortions of the hierarchical clusterings
+    of the sweep data table with (min_size) to (max_size) clusters
+    '''
+    #a single merge history provides the hierarchical clusterings for every size
+    merge_history = SWEEP_STATE['result_cache'].get_or_compute(
+        (SWEEP_STATE['data_hash'], 'hierarchical_history', None, None),
+        lambda: hierarchical_merge_history(SWEEP_STATE['singleton_list']))
+    return [merge_history.distortion(num_clusters) for num_clusters in range(min_size, max_size + 1)]
+
 
+def run_sweep(tasks, data_table = None, max_workers = None, cache_dir = None):
+    '''
+    Runs (tasks), a list of tuples of the form (func, arg1, arg2, ...),
+    in a pool of (max_workers) processes (one per core by default).
+    The (data_table) is shipped to every worker only once, when it starts.
+    With (max_workers) equal to 1 the tasks run in the current process.
+    Clusterings are memoized as set up by (init_sweep_worker) with (cache_dir).
+
+    Returns the list of results in the order of (tasks)
+    '''
+    if max_workers == 1:
+        init_sweep_worker(data_table, reseed = False, cache_dir = cache_dir)
+        return [task[0](*task[1:]) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers = max_workers, initializer = init_sweep_worker,
+                             initargs = (data_table, True, cache_dir)) as executor:
+        futures = [executor.submit(*task) for task in tasks]
+        return [future.result() for future in futures]
+
+
+def sweep_efficiency (min_size, max_size, max_workers = None):
+    '''
+    Computes the running times of the closest pair functions
+    for every number of clusters in [min_size : max_size] in parallel
+    (running times measured concurrently may be inflated, 
+    use (max_workers) = 1 for undisturbed timings)
+
+    Returns the lists (x_vals, y_vals_fast, y_vals_brute, y_vals_randomized)
+    '''
+    x_vals = list(range(min_size, max_size + 1))
+    run_times = run_sweep([(fast_vs_brute, num_clusters) for num_clusters in x_vals], max_workers = max_workers)
+    y_vals_fast, y_vals_brute, y_vals_randomized = (list(vals) for vals in zip(*run_times)) if run_times else ([], [], [])
+    return x_vals, y_vals_fast, y_vals_brute, y_vals_randomized
 
-def plot_efficiency (min_size, max_size):
+
+def sweep_distortion (data_table, min_size, max_size, num_iter, max_workers = None, cache_dir = None):
+    '''
+    Computes the distortion of (hierarchical_clustering) and (kmeans_clustering)
+    for every number of clusters in [min_size : max_size] in parallel:
+    every k-means run is a separate task, while a single hierarchical run
+    provides the distortions for every number of clusters
+
+    Returns the lists (x_vals, y_vals_hierarchical, y_vals_kmeans)
+    '''
+    x_vals = list(range(min_size, max_size + 1))
+    tasks = [(hierarchical_distortions_task, min_size, max_size)]
+    tasks += [(kmeans_distortion_task, num_clusters, num_iter) for num_clusters in x_vals]
+    results = run_sweep(tasks, data_table, max_workers, cache_dir)
+    return x_vals, results[0], results[1: ]
+
+
+def plot_efficiency (min_size, max_size, max_workers = None):
     """
-    Computes and plots the efficiency of (fast_closest_pair)
-    and (slow_closest_pair), as a function of running time and
-    number of processed clusters. 
+    Computes and plots the efficiency of (fast_closest_pair),
+    (slow_closest_pair) and (randomized_closest_pair), as a function 
+    of running time and number of processed clusters. 
     """
-    x_vals = []
-    y_vals_fast = []
-    y_vals_brute = []
-    for num_clusters in range (min_size, max_size + 1):
-        x_vals.append(num_clusters)
-        #compute the run times for both funcs and append to y-values
-        run_times = fast_vs_brute(num_clusters)
-        y_vals_fast.append(run_times[0])
-        y_vals_brute.append(run_times[1])
+    #compute the run times for all funcs in parallel
+    x_vals, y_vals_fast, y_vals_brute, y_vals_randomized = sweep_efficiency(min_size, max_size, max_workers)
 
     #assign title and axis names
-    plt.title('(fast_closest_pair) and (slow_closest_pair) efficiency comparison')
+    plt.title('Closest pair algorithms efficiency comparison')
     plt.xlabel('Number of clusters')
     plt.ylabel('Running time')  
     
     #plot the run times
     plt.plot(x_vals, y_vals_fast, '-b', label = 'Fast')
     plt.plot(x_vals, y_vals_brute, '-r', label = 'Brute force')
+    plt.plot(x_vals, y_vals_randomized, '-g', label = 'Randomized')
     plt.legend(loc = 'upper left', title = f'({min_size}, {max_size})')
 
     #exhibit the graphs
     plt.show()
 
 
-def plot_distortion(min_size, max_size, url):
+def plot_distortion(min_size, max_size, url, max_workers = None, cache_dir = None):
     '''
     Computes and plots the distortion for (hierarchical_clustering)
     and (kmeans_clustering) algorithms for the range of [min_size : max_size] 
     clusters obtained from the data provided via an external (url) link
+    (clusterings computed before are reused from (cache_dir) if given)
     '''
     NUM_ITER = 5
     data_table = load_data_table(url)
     
-    singleton_list = []
-    for line in data_table:
-        singleton_list.append(Cluster(set([line[0]]), line[1], line[2], line[3], line[4]))
-    
-    x_vals = []
-    y_vals_hierarchical = []
-    y_vals_kmeans = []
-    clusters_hierarchical = hierarchical_clustering(list(singleton_list), 21)
-    
-    for num_clusters in range (max_size, min_size - 1, -1):
-        x_vals.insert(0, num_clusters)
-        #compute (num_clusters) clusters for both funcs
-        clusters_hierarchical = hierarchical_clustering(clusters_hierarchical, num_clusters)
-        clusters_kmeans = kmeans_clustering(singleton_list, num_clusters, NUM_ITER)
-        #compute the distortion for both funcs and append to y-values
-        y_vals_hierarchical.insert(0, compute_distortion(clusters_hierarchical, data_table))
-        y_vals_kmeans.insert(0, compute_distortion(clusters_kmeans, data_table))
+    #compute the distortions for both funcs in parallel
+    x_vals, y_vals_hierarchical, y_vals_kmeans = sweep_distortion(data_table, min_size, max_size, 
+                                                                  NUM_ITER, max_workers, cache_dir)
 
     #assign title and axis names
     plt.title(f'Distortions for {len(data_table)} county data set')
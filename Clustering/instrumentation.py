@@ -0,0 +1,147 @@
+"""
+Opt-in instrumentation of the clustering algorithms
+
+While a Report is recording, the functions of project_3 and alg_cluster add their
+counters (distance evaluations, recursion depth, strip sizes, iterations, merges ...),
+per-phase timings and per-merge costs to it. Otherwise they only check that no report
+is active, so instrumentation costs almost nothing when it is disabled.
+
+    with recording() as report:
+        hierarchical_clustering(cluster_list, 15)
+    print(report.to_json())
+"""
+
+import contextlib
+import json
+import time
+
+# report the algorithms record into (None while instrumentation is disabled)
+ACTIVE_REPORT = None
+
+_NULL_PHASE = contextlib.nullcontext()
+
+
+class Report:
+    """
+    Class for collecting named counters, maxima, phase timings and series of values
+    """
+
+    def __init__(self):
+        """
+        Create an empty report
+        """
+        self._counters = {}
+        self._maxima = {}
+        self._timings = {}
+        self._series = {}
+
+
+    def count(self, name, amount=1):
+        """
+        Add amount to a counter
+        """
+        self._counters[name] = self._counters.get(name, 0) + amount
+
+    def maximum(self, name, value):
+        """
+        Raise a maximum to value if it is larger
+        """
+        if name not in self._maxima or value > self._maxima[name]:
+            self._maxima[name] = value
+
+    def append(self, name, value):
+        """
+        Append a value to a series (such as the cost of every merge)
+        """
+        self._series.setdefault(name, []).append(value)
+
+    def add_time(self, name, seconds):
+        """
+        Add one timed call lasting seconds to a phase
+        """
+        timing = self._timings.setdefault(name, [0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager timing the code it wraps as one call of a phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+
+    def counter(self, name):
+        """
+        Get the value of a counter (0 if it was never counted)
+        """
+        return self._counters.get(name, 0)
+
+    def max_value(self, name):
+        """
+        Get the value of a maximum (None if it was never recorded)
+        """
+        return self._maxima.get(name)
+
+    def timing(self, name):
+        """
+        Get the tuple (calls, seconds) of a phase
+        """
+        calls, seconds = self._timings.get(name, (0, 0.0))
+        return calls, seconds
+
+    def series(self, name):
+        """
+        Get the list of values of a series
+        """
+        return list(self._series.get(name, []))
+
+    def to_dict(self):
+        """
+        Return the content of the report as a dictionary of plain values
+        """
+        return {'counters': dict(sorted(self._counters.items())),
+                'maxima': dict(sorted(self._maxima.items())),
+                'timings': {name: {'calls': calls, 'seconds': seconds}
+                            for name, (calls, seconds) in sorted(self._timings.items())},
+                'series': {name: list(values) for name, values in sorted(self._series.items())}}
+
+    def to_json(self, indent=2):
+        """
+        Return the content of the report as a JSON string
+        """
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def write_json(self, path):
+        """
+        Write the content of the report to a JSON file
+        """
+        with open(path, 'w', encoding='utf-8') as report_file:
+            report_file.write(self.to_json())
+
+
+@contextlib.contextmanager
+def recording(report=None):
+    """
+    Context manager making a report (a new one by default) active while the code it wraps runs
+    """
+    global ACTIVE_REPORT
+    if report is None:
+        report = Report()
+    previous, ACTIVE_REPORT = ACTIVE_REPORT, report
+    try:
+        yield report
+    finally:
+        ACTIVE_REPORT = previous
+
+
+def phase(name):
+    """
+    Get a context manager timing a phase into the active report (doing nothing if there is none)
+    """
+    report = ACTIVE_REPORT
+    return report.phase(name) if report is not None else _NULL_PHASE
@@ -0,0 +1,329 @@
+"""
+This module contains d-dimensional versions of the closest pair, hierarchical
+and k-means clustering functions of (project_3), which cluster counties on any
+features of the clusters (such as their position and averaged risk) instead of
+their horizontal and vertical centers only
+
+The engine works on arrays of points of shape (n, d). Optional per-dimension
+weights w give the weighted Euclidean distance sqrt(sum w_k (a_k - b_k)^2),
+obtained by scaling every dimension of the points by sqrt(w_k) once. The distance
+kernels loop over the d dimensions and are vectorized over blocks of points of
+bounded size, so their cost grows linearly with d; the ones shared with (project_3),
+which calls them with d = 2, are imported from it.
+
+The features are not rescaled: without weights, a feature that varies much less
+than the others (such as the averaged risk, about 1e-5, next to positions of about 1e2)
+has almost no effect on the distances. Pass the weights of standard_weights to give
+every feature the same spread.
+"""
+
+import numpy as np
+import alg_cluster
+from project_3 import DIST_BLOCK_SIZE, nearest_centers, merge_nearest_points
+
+# features of a cluster used by default: accessor methods of alg_cluster.Cluster
+# (unweighted, the risk barely affects the distances; see standard_weights)
+DEFAULT_FEATURES = ('horiz_center', 'vert_center', 'averaged_risk')
+# number of points in a leaf of the k-d tree used by closest_pair
+ROW_BLOCK_SIZE = 256
+# relative error bound of squared distances computed from a Gram matrix
+GRAM_TOLERANCE = 1e-10
+
+
+def scale_points(points, weights=None):
+    """
+    Helper function that scales the dimensions of points by the square roots of their weights
+
+    Input: array of points of shape (n, d), optional sequence of d non-negative weights
+    Output: array of shape (n, d) of floats (a new array)
+    """
+    points = np.array(points, dtype=float, ndmin=2)
+    if weights is None:
+        return points
+    weights = np.asarray(weights, dtype=float)
+    if weights.shape != (points.shape[1], ):
+        raise ValueError(f'Expected {points.shape[1]} weights, got {weights.shape}')
+    if np.any(weights < 0):
+        raise ValueError(f'Invalid weights provided = {weights.tolist()}')
+    return points * np.sqrt(weights)
+
+
+def standard_weights(points):
+    """
+    Compute the weights giving every dimension of a set of points unit variance
+    (1 for constant dimensions), which standardizes features of different scales
+
+    Input: array of points of shape (n, d)
+    Output: array of d weights, to be passed as weights to the clustering functions
+    """
+    variances = np.var(np.asarray(points, dtype=float).reshape(len(points), -1), axis=0)
+    return 1 / np.where(variances > 0, variances, 1)
+
+
+def feature_matrix(cluster_list, features=DEFAULT_FEATURES, weights=None):
+    """
+    Build the array of (weighted) feature points of a list of clusters
+
+    Input: list of clusters, sequence of features given either as names of accessor
+    methods of the clusters or as functions of a cluster, optional weights
+    Output: array of shape (len(cluster_list), len(features))
+    """
+    getters = [feature if callable(feature) else (lambda cluster, name=feature: getattr(cluster, name)())
+               for feature in features]
+    points = np.array([[getter(cluster) for getter in getters] for cluster in cluster_list], dtype=float)
+    return scale_points(points.reshape(len(cluster_list), len(features)), weights)
+
+
+def block_closest_pair(points1, points2, same=False, origin=None):
+    """
+    Helper function that finds the closest pair between two blocks of points
+
+    The squared distances are first computed with a matrix product as
+    |a|^2 + |b|^2 - 2 a.b, which is fast but inexact; the pairs within its error
+    bound of the smallest one are then recomputed exactly (as project_3.squared_distances does).
+
+    Input: arrays of points of shapes (n1, d) and (n2, d), whether both are the same block
+    (in which case only the pairs (row, col) with row < col are considered), optional point
+    subtracted from both blocks in the matrix product to keep the norms and errors small
+    Output: tuple of the form (dist, row, col) (dist is inf if there is no pair)
+    """
+    centered1 = points1 if origin is None else points1 - origin
+    centered2 = points2 if origin is None else points2 - origin
+    norms1, norms2 = np.sum(centered1 ** 2, axis=1), np.sum(centered2 ** 2, axis=1)
+    approx = norms1[:, None] + norms2[None, :] - 2 * (centered1 @ centered2.T)
+    if same:
+        approx[np.tril_indices(len(points1), m=len(points2))] = np.inf
+    min_approx = approx.min() if approx.size else np.inf
+    if min_approx == np.inf:
+        return float('inf'), -1, -1
+
+    tolerance = GRAM_TOLERANCE * (norms1.max() + norms2.max())
+    rows, cols = np.nonzero(approx <= min_approx + 2 * tolerance)
+    squares = np.zeros(len(rows))
+    for dim in range(points1.shape[1]):
+        squares += (points1[rows, dim] - points2[cols, dim]) ** 2
+    dists = np.sqrt(squares)
+    pos = int(np.argmin(dists))
+    return float(dists[pos]), int(rows[pos]), int(cols[pos])
+
+
+def kd_leaves(points, leaf_size):
+    """
+    Helper function that partitions points into the leaves of a k-d tree, splitting
+    every range of more than leaf_size points at the median of its widest dimension
+
+    Input: array of points of shape (n, d), integer leaf size
+    Output: tuple (order, starts) where points[order] lists the points leaf by leaf
+    and starts holds the position of the first point of every leaf in this order
+    """
+    order = np.arange(len(points))
+    starts = []
+    ranges = [(0, len(points))]
+    while ranges:
+        low, high = ranges.pop()
+        if high - low <= leaf_size:
+            starts.append(low)
+            continue
+        range_points = points[order[low:high]]
+        axis = int(np.argmax(np.ptp(range_points, axis=0)))
+        mid = (high - low) // 2
+        order[low:high] = order[low:high][np.argpartition(range_points[:, axis], mid)]
+        ranges.extend([(low + mid, high), (low, low + mid)])
+    return order, np.array(starts, dtype=np.intp)
+
+
+def closest_pair(points):
+    """
+    Compute the closest pair of d-dimensional points
+
+    The points are partitioned into the leaves of a k-d tree. The closest pairs within
+    the leaves give an upper bound of the minimum distance; then every leaf is compared
+    only with the following leaves whose bounding boxes lie closer than the smallest
+    distance found so far. All the distances of a leaf are computed in one block
+    (see block_closest_pair).
+
+    Input: array of points of shape (n, d)
+    Output: tuple of the form (dist, idx1, idx2) where the points idx1 < idx2
+    have minimum distance dist
+    """
+    num = len(points)
+    if num < 2:
+        return float('inf'), -1, -1
+
+    order, starts = kd_leaves(points, ROW_BLOCK_SIZE)
+    sorted_points = points[order]
+    origin = points.mean(axis=0)
+    stops = np.append(starts[1: ], num)
+    lows = np.minimum.reduceat(sorted_points, starts, axis=0)
+    highs = np.maximum.reduceat(sorted_points, starts, axis=0)
+    min_dist, pos1, pos2 = float('inf'), -1, -1
+
+    # pairs within every leaf
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        dist, row, col = block_closest_pair(sorted_points[start:stop], sorted_points[start:stop], True, origin)
+        if dist < min_dist:
+            min_dist, pos1, pos2 = dist, start + row, start + col
+
+    # pairs between a leaf and the following leaves close enough to hold a closer pair
+    col_block = max(1, DIST_BLOCK_SIZE // ROW_BLOCK_SIZE)
+    for leaf in range(len(starts) - 1):
+        gaps = np.maximum(np.maximum(lows[leaf + 1: ] - highs[leaf], lows[leaf] - highs[leaf + 1: ]), 0)
+        near = leaf + 1 + np.flatnonzero(np.sqrt(np.sum(gaps ** 2, axis=1)) < min_dist)
+        if len(near) == 0:
+            continue
+        cols = np.concatenate([np.arange(starts[other], stops[other]) for other in near.tolist()])
+        start, stop = int(starts[leaf]), int(stops[leaf])
+        for col_start in range(0, len(cols), col_block):
+            block_cols = cols[col_start:col_start + col_block]
+            dist, row, col = block_closest_pair(sorted_points[start:stop], sorted_points[block_cols], False, origin)
+            if dist < min_dist:
+                min_dist, pos1, pos2 = dist, start + row, int(block_cols[col])
+
+    idx1, idx2 = int(order[pos1]), int(order[pos2])
+    return min_dist, min(idx1, idx2), max(idx1, idx2)
+
+
+def merge_closest_pairs(points, population, num_clusters):
+    """
+    Helper generator that repeatedly merges the closest pair of d-dimensional points
+    into their population-weighted mean, with project_3.merge_nearest_points
+    Note: the function mutates points and population
+
+    Input: array of points of shape (n, d), array of their populations,
+    integer number of points left when merging stops
+    Output: yields a tuple of the form (dist, idx1, idx2) after each merge, where the point
+    idx2 (with idx1 < idx2) was merged into the point idx1 and dist is the distance between them
+    before the merge
+    """
+    population = np.asarray(population)
+
+    def merge(idx1, idx2):
+        """
+        Merge the point with the larger index into the other one
+        """
+        idx1, idx2 = min(idx1, idx2), max(idx1, idx2)
+        # population-weighted as Cluster.merge_clusters; two points without population,
+        # which merge_clusters cannot merge, are given equal weights instead
+        total_population = population[idx1] + population[idx2]
+        if total_population > 0:
+            weight1, weight2 = population[idx1] / total_population, population[idx2] / total_population
+        else:
+            weight1 = weight2 = 0.5
+        points[idx1] = weight1 * points[idx1] + weight2 * points[idx2]
+        population[idx1] = total_population
+        return idx1, idx2
+
+    yield from merge_nearest_points(points, num_clusters, merge)
+
+
+def kmeans(points, population, num_clusters, num_iterations):
+    """
+    Compute the k-means clustering of d-dimensional points, as project_3.kmeans_arrays does in 2D:
+    the centers start at the points with largest populations, are population-weighted means
+    of their points, and the iterations stop early once the assignment stops changing
+
+    Input: array of points of shape (n, d), array of their populations,
+    integers number of clusters and (maximum) number of iterations
+    Output: tuple of the form (assignment, centers, center_pop) where assignment[i] is
+    the cluster of point i (-1 if it was not assigned to any cluster)
+    """
+    population = np.asarray(population, dtype=float)
+    initial = np.argsort(-population, kind='stable')[ :num_clusters]
+    num_centers = len(initial)
+    centers, center_pop = points[initial], population[initial]
+    assignment = np.full(len(points), -1, dtype=np.intp)
+    assignment[initial] = np.arange(num_centers)
+
+    for _ in range(num_iterations):
+        new_assignment = nearest_centers(points, centers)
+        if np.array_equal(new_assignment, assignment):
+            break
+        assignment = new_assignment
+
+        center_pop = np.bincount(assignment, weights=population, minlength=num_centers)
+        # empty clusters stay at the origin, as in project_3
+        weights = np.where(center_pop > 0, center_pop, 1)
+        centers = np.column_stack([np.bincount(assignment, weights=population * points[:, dim],
+                                               minlength=num_centers) / weights
+                                   for dim in range(points.shape[1])]).reshape(num_centers, points.shape[1])
+
+    return assignment, centers, center_pop
+
+
+def closest_cluster_pair(cluster_list, features=DEFAULT_FEATURES, weights=None):
+    """
+    Compute the distance between the closest pair of clusters in a list
+    over the given (weighted) features
+
+    Input: list of clusters, features and weights as in feature_matrix
+    Output: tuple of the form (dist, idx1, idx2) where the clusters cluster_list[idx1]
+    and cluster_list[idx2] have minimum distance dist
+    """
+    return closest_pair(feature_matrix(cluster_list, features, weights))
+
+
+def hierarchical_clustering(cluster_list, num_clusters, features=DEFAULT_FEATURES, weights=None):
+    """
+    Compute a hierarchical clustering of a set of clusters over the given (weighted) features
+    Note: the function mutates cluster_list
+
+    Input: list of clusters, integer number of clusters, features and weights as in feature_matrix
+    Output: List of clusters whose length is num_clusters (sorted by horizontal center)
+    """
+    points = feature_matrix(cluster_list, features, weights)
+
+    def merge(idx1, idx2):
+        """
+        Merge two clusters into the one with the smaller index and store its features
+        """
+        idx1, idx2 = min(idx1, idx2), max(idx1, idx2)
+        cluster_list[idx1].merge_clusters(cluster_list[idx2])
+        # take the features of the merged cluster itself, which need not be averages
+        points[idx1] = feature_matrix([cluster_list[idx1]], features, weights)[0]
+        return idx1, idx2
+
+    merged_idxs = set()
+    for _, _, idx2 in merge_nearest_points(points, num_clusters, merge):
+        merged_idxs.add(idx2)
+
+    cluster_list[:] = sorted((cluster for idx, cluster in enumerate(cluster_list) if idx not in merged_idxs),
+                             key = lambda cluster: cluster.horiz_center())
+    return cluster_list
+
+
+def kmeans_clustering(cluster_list, num_clusters, num_iterations, features=DEFAULT_FEATURES, weights=None):
+    """
+    Compute the k-means clustering of a set of clusters over the given (weighted) features
+
+    Input: list of clusters, integers number of clusters and number of iterations,
+    features and weights as in feature_matrix
+    Output: List of clusters whose length is num_clusters; their centers and risks
+    are the population-weighted means of their counties' ones
+    """
+    population = np.array([cluster.total_population() for cluster in cluster_list], dtype=float)
+    assignment, centers, _ = kmeans(feature_matrix(cluster_list, features, weights), population,
+                                    num_clusters, num_iterations)
+    num_centers = len(centers)
+
+    # weighted sums of the clusters assigned to every center
+    assigned = assignment >= 0
+    labels, assigned_pop = assignment[assigned], population[assigned]
+    sums = [np.bincount(labels, weights=assigned_pop * np.array(values, dtype=float)[assigned],
+                        minlength=num_centers)
+            for values in ([1.0] * len(cluster_list),
+                           [cluster.horiz_center() for cluster in cluster_list],
+                           [cluster.vert_center() for cluster in cluster_list],
+                           [cluster.averaged_risk() for cluster in cluster_list])]
+    pop_sums = sums[0]
+    weights = np.where(pop_sums > 0, pop_sums, 1)
+
+    members = [set() for _ in range(num_centers)]
+    moments = [(0, 0.0, 0.0, 0.0)] * num_centers
+    for cluster, cluster_idx in zip(cluster_list, assignment.tolist()):
+        if cluster_idx >= 0:
+            members[cluster_idx].update(cluster.fips_codes())
+            moments[cluster_idx] = alg_cluster.add_moments(moments[cluster_idx], cluster.moments())
+
+    return [alg_cluster.Cluster(members[idx], float(sums[1][idx] / weights[idx]), float(sums[2][idx] / weights[idx]),
+                                int(round(pop_sums[idx])), float(sums[3][idx] / weights[idx]), moments[idx])
+            for idx in range(num_centers)]
@@ -4,7 +4,25 @@ with each point representing a specific county in USA with parameters
 specified as class instance attributes in (alg_cluster) module
 """
 
+import heapq
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
 import alg_cluster
+import instrumentation
+from spatial_index import GridIndex
+
+# upper bound on the number of entries in a block of the pairwise distance matrix
+DIST_BLOCK_SIZE = 2 ** 22
+# ranges of at most this many centers are solved by brute force in fast_closest_pair
+CLOSEST_PAIR_LEAF_SIZE = 64
+# number of following centers in a strip that can lie closer than its half width
+STRIP_NEIGHBORS = 7
+# relative safety margin for comparing distance bounds, which accumulate rounding errors
+BOUND_TOLERANCE = 1e-9
+# smallest number of centers for which fast_closest_pair uses a pool of processes
+PARALLEL_MIN_SIZE = 2 ** 16
 
 
 def pair_distance(cluster_list, idx1, idx2):
@@ -40,49 +58,35 @@ def slow_closest_pair(cluster_list):
                 min_dist = curr_dist[0]
                 idx1 = min(cluster_idx1, cluster_idx2)
                 idx2 = max(cluster_idx1, cluster_idx2)
-    
+
+    report = instrumentation.ACTIVE_REPORT
+    if report is not None:
+        report.count('closest_pair.distances', len(cluster_list) * (len(cluster_list) - 1) // 2)
     return min_dist, idx1, idx2
 
 
-def fast_closest_pair(cluster_list):
+def fast_closest_pair(cluster_list, num_workers=None):
     """
     Compute the distance between the closest pair of clusters in a list (fast)
 
-    Input: cluster_list is list of clusters SORTED such that horizontal positions of their
-    centers are in ascending order
+    The centers are sorted once by horizontal and once by vertical position and the
+    divide and conquer works on index ranges of these orders, so no level copies
+    the list or sorts its strip (see array_closest_pair).
+
+    Input: cluster_list is list of clusters (usually sorted such that horizontal positions
+    of their centers are in ascending order, though any order works), or a ClusterSet
+    (inactive rows are skipped); with num_workers above 1, large inputs are solved by
+    a pool of that many processes (see parallel_range_closest_pair)
     
     Output: tuple of the form (dist, idx1, idx2) where the centers of the clusters
     cluster_list[idx1] and cluster_list[idx2] have minimum distance dist.       
     """
-    cluster_num = len(cluster_list)
-    if cluster_num <= 3:
-        return slow_closest_pair(cluster_list)
-
-    mid_idx = cluster_num // 2
-    dist_l, idx_l1, idx_l2 = fast_closest_pair(cluster_list[ :mid_idx])
-    dist_r, idx_r1, idx_r2 = fast_closest_pair(cluster_list[mid_idx: ])
-
-    if dist_l < dist_r:
-        min_dist = dist_l
-        idx1 = idx_l1
-        idx2 = idx_l2
-    else:
-        min_dist = dist_r
-        idx1 = idx_r1 + mid_idx
-        idx2 = idx_r2 + mid_idx
-
-    horiz1 = cluster_list[mid_idx - 1].horiz_center()
-    horiz2 = cluster_list[mid_idx].horiz_center()
-    mid = (horiz1 + horiz2) / 2
+    if isinstance(cluster_list, alg_cluster.ClusterSet):
+        return cluster_set_closest_pair(cluster_list, num_workers)
 
-    dist_strip, idx1_strip, idx2_strip = closest_pair_strip(cluster_list, mid, min_dist)
-
-    if dist_strip < min_dist:
-        min_dist = dist_strip
-        idx1 = idx1_strip
-        idx2 = idx2_strip
-
-    return min_dist, idx1, idx2
+    return array_closest_pair(np.array([cluster.horiz_center() for cluster in cluster_list], dtype=float),
+                              np.array([cluster.vert_center() for cluster in cluster_list], dtype=float),
+                              num_workers)
 
 
 def closest_pair_strip(cluster_list, horiz_center, half_width):
@@ -118,48 +122,1120 @@ def closest_pair_strip(cluster_list, horiz_center, half_width):
     return min_dist, min_idx1, min_idx2
             
 
-def hierarchical_clustering(cluster_list, num_clusters, *_):
+def cluster_set_closest_pair(cluster_set, num_workers=None):
+    """
+    Compute the distance between the closest pair of active clusters in a ClusterSet
+
+    Input: cluster_set is a ClusterSet, num_workers as in fast_closest_pair
+
+    Output: tuple of the form (dist, idx1, idx2) where the centers of the clusters
+    in rows idx1 and idx2 of cluster_set have minimum distance dist.
+    """
+    rows = cluster_set.active_rows()
+    dist, idx1, idx2 = array_closest_pair(cluster_set.horiz_centers()[rows], cluster_set.vert_centers()[rows],
+                                          num_workers)
+    if idx1 < 0:
+        return dist, -1, -1
+
+    idx1, idx2 = int(rows[idx1]), int(rows[idx2])
+    return dist, min(idx1, idx2), max(idx1, idx2)
+
+
+def array_closest_pair(horiz, vert, num_workers=None):
+    """
+    Compute the closest pair of centers stored in arrays in O(n log n)
+
+    The centers are presorted by horizontal position, and the positions in this order
+    are presorted by vertical position. Every level of the divide and conquer splits
+    the vertical order of its range in two with a stable partition, so the strip
+    around the dividing line comes out already sorted by vertical position.
+
+    Input: horiz and vert are arrays of centers (in any order), num_workers as in fast_closest_pair
+
+    Output: tuple of the form (dist, idx1, idx2) where the centers idx1 and idx2
+    have minimum distance dist.
+    """
+    num = len(horiz)
+    if num < 2:
+        return float('inf'), -1, -1
+
+    order = np.argsort(horiz, kind='stable')
+    sorted_horiz, sorted_vert = horiz[order], vert[order]
+    by_vert = np.argsort(sorted_vert, kind='stable')
+    if num_workers is not None and num_workers > 1 and num >= PARALLEL_MIN_SIZE:
+        dist, pos1, pos2 = parallel_range_closest_pair(sorted_horiz, sorted_vert, by_vert, num_workers)
+    else:
+        dist, pos1, pos2 = range_closest_pair(sorted_horiz, sorted_vert, 0, num, by_vert)
+
+    idx1, idx2 = int(order[pos1]), int(order[pos2])
+    return dist, min(idx1, idx2), max(idx1, idx2)
+
+
+def range_closest_pair(horiz, vert, low, high, by_vert, depth=1):
+    """
+    Helper function that computes the closest pair of the centers in positions low .. high - 1
+    (the recursion depth is logarithmic, which keeps it far below the recursion limit)
+
+    Input: horiz and vert are arrays of centers SORTED by horizontal position,
+    low and high delimit a range of at least two positions, by_vert holds the
+    positions of the range ordered by vertical position and depth is the recursion depth
+
+    Output: tuple of the form (dist, pos1, pos2) where the centers in positions
+    pos1 < pos2 have minimum distance dist.
+    """
+    report = instrumentation.ACTIVE_REPORT
+    if high - low <= CLOSEST_PAIR_LEAF_SIZE:
+        if report is not None:
+            report.maximum('closest_pair.recursion_depth', depth)
+            report.count('closest_pair.leaves')
+            report.count('closest_pair.distances', (high - low) * (high - low - 1) // 2)
+        range_horiz, range_vert = horiz[low:high], vert[low:high]
+        dists = np.sqrt((range_vert[:, None] - range_vert[None, :]) ** 2 +
+                        (range_horiz[:, None] - range_horiz[None, :]) ** 2)
+        dists[np.tril_indices(high - low)] = np.inf
+        pos1, pos2 = divmod(int(np.argmin(dists)), high - low)
+        return float(dists[pos1, pos2]), low + pos1, low + pos2
+
+    mid = (low + high) // 2
+    in_left = by_vert < mid
+    left_pair = range_closest_pair(horiz, vert, low, mid, by_vert[in_left], depth + 1)
+    right_pair = range_closest_pair(horiz, vert, mid, high, by_vert[~in_left], depth + 1)
+    return strip_closest_pair(horiz, vert, mid, by_vert, left_pair, right_pair)
+
+
+def strip_closest_pair(horiz, vert, mid, by_vert, left_pair, right_pair):
+    """
+    Helper function that combines the closest pairs of the two halves of a range
+    with the closest pair across the strip around their dividing line
+
+    Input: horiz and vert are arrays of centers SORTED by horizontal position, mid is the
+    first position of the right half, by_vert holds the positions of the range ordered by
+    vertical position, left_pair and right_pair are the closest pairs (dist, pos1, pos2)
+    of the halves
+
+    Output: tuple of the form (dist, pos1, pos2) where the centers in positions
+    pos1 < pos2 of the range have minimum distance dist.
+    """
+    report = instrumentation.ACTIVE_REPORT
+    min_dist, pos1, pos2 = left_pair
+    if right_pair[0] < min_dist:
+        min_dist, pos1, pos2 = right_pair
+
+    # compare every center of the strip with the next centers sorted by vertical position
+    mid_line = (horiz[mid - 1] + horiz[mid]) / 2
+    strip = by_vert[np.abs(horiz[by_vert] - mid_line) < min_dist]
+    if report is not None:
+        report.count('closest_pair.strips')
+        report.count('closest_pair.strip_centers', len(strip))
+        report.maximum('closest_pair.max_strip_size', len(strip))
+        report.count('closest_pair.distances', sum(max(len(strip) - offset, 0)
+                                                    for offset in range(1, STRIP_NEIGHBORS + 1)))
+    for offset in range(1, min(STRIP_NEIGHBORS, len(strip) - 1) + 1):
+        dists = np.sqrt((vert[strip[ :-offset]] - vert[strip[offset: ]]) ** 2 +
+                        (horiz[strip[ :-offset]] - horiz[strip[offset: ]]) ** 2)
+        strip_pos = int(np.argmin(dists))
+        if dists[strip_pos] < min_dist:
+            min_dist = float(dists[strip_pos])
+            pos1 = int(min(strip[strip_pos], strip[strip_pos + offset]))
+            pos2 = int(max(strip[strip_pos], strip[strip_pos + offset]))
+
+    return min_dist, pos1, pos2
+
+
+def parallel_range_closest_pair(horiz, vert, by_vert, num_workers):
+    """
+    Helper function that computes the closest pair of centers with the divide and
+    conquer of range_closest_pair, solving the ranges of its top levels in a pool of processes
+
+    The ranges are split as range_closest_pair splits them until they hold at most
+    about 1 / num_workers of the centers. Every range is solved by a worker reading the
+    centers from shared memory (so they are not pickled), then the strips of the top levels
+    are merged in this process, which gives the same result as the serial version.
+
+    Input: horiz and vert are arrays of centers SORTED by horizontal position, by_vert holds
+    all the positions ordered by vertical position, num_workers is the number of processes
+
+    Output: tuple of the form (dist, pos1, pos2) where the centers in positions
+    pos1 < pos2 have minimum distance dist.
+    """
+    num = len(horiz)
+    chunk_size = max(CLOSEST_PAIR_LEAF_SIZE, -(-num // num_workers))
+
+    # ranges of the top levels, in the order range_closest_pair visits them
+    chunks = []
+    ranges = [(0, num)]
+    while ranges:
+        low, high = ranges.pop()
+        if high - low <= chunk_size:
+            chunks.append((low, high))
+        else:
+            ranges.extend([((low + high) // 2, high), (low, (low + high) // 2)])
+
+    memory = shared_memory.SharedMemory(create=True, size=max(1, 2 * num * np.dtype(float).itemsize))
+    try:
+        centers = np.ndarray((2, num), dtype=float, buffer=memory.buf)
+        centers[0], centers[1] = horiz, vert
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {chunk: executor.submit(shared_range_closest_pair, memory.name, num, *chunk)
+                       for chunk in chunks}
+            chunk_pairs = {chunk: future.result() for chunk, future in futures.items()}
+        del centers
+    finally:
+        memory.close()
+        memory.unlink()
+
+    def merge_range(low, high, range_by_vert):
+        """
+        Combine the closest pairs of the chunks of a range as range_closest_pair would
+        """
+        if (low, high) in chunk_pairs:
+            return chunk_pairs[(low, high)]
+        mid = (low + high) // 2
+        in_left = range_by_vert < mid
+        left_pair = merge_range(low, mid, range_by_vert[in_left])
+        right_pair = merge_range(mid, high, range_by_vert[~in_left])
+        return strip_closest_pair(horiz, vert, mid, range_by_vert, left_pair, right_pair)
+
+    return merge_range(0, num, by_vert)
+
+
+def shared_range_closest_pair(memory_name, num, low, high):
+    """
+    Helper function run by the workers of parallel_range_closest_pair, which computes the
+    closest pair of the centers in positions low .. high - 1 stored in a shared memory block
+
+    Input: name of the shared memory block holding the sorted horizontal and vertical positions
+    of num centers, bounds of the range
+
+    Output: tuple of the form (dist, pos1, pos2) as range_closest_pair returns
+    """
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        centers = np.ndarray((2, num), dtype=float, buffer=memory.buf)
+        horiz, vert = centers[0], centers[1]
+        # the stable order of the range is the order of all the positions restricted to it
+        by_vert = low + np.argsort(vert[low:high], kind='stable')
+        pair = range_closest_pair(horiz, vert, low, high, by_vert)
+        del centers, horiz, vert
+        return pair
+    finally:
+        memory.close()
+
+
+def randomized_closest_pair(cluster_list, seed=None):
+    """
+    Compute the distance between the closest pair of clusters in a list (randomized)
+
+    Follows Rabin's grid hashing approach, which runs in expected linear time:
+    the closest pair of a random sample of about n^(2/3) clusters gives an upper bound
+    delta of the minimum distance. Hashing every center into the grid cell of side delta
+    that contains it, the closest pair is then found among the pairs of centers lying in
+    the same or in adjacent cells, of which there are O(n) in expectation.
+
+    Input: cluster_list is list of clusters (in any order) or a ClusterSet (inactive rows are
+    skipped), seed optionally seeds the random sample
+    
+    Output: tuple of the form (dist, idx1, idx2) where the centers of the clusters
+    cluster_list[idx1] and cluster_list[idx2] have minimum distance dist.       
+    """
+    if isinstance(cluster_list, alg_cluster.ClusterSet):
+        rows = cluster_list.active_rows()
+        horiz, vert = cluster_list.horiz_centers()[rows], cluster_list.vert_centers()[rows]
+    else:
+        rows = None
+        horiz = np.array([cluster.horiz_center() for cluster in cluster_list], dtype=float)
+        vert = np.array([cluster.vert_center() for cluster in cluster_list], dtype=float)
+
+    dist, idx1, idx2 = grid_closest_pair(horiz, vert, np.random.default_rng(seed))
+    if rows is not None and idx1 >= 0:
+        idx1, idx2 = int(rows[idx1]), int(rows[idx2])
+    return dist, min(idx1, idx2), max(idx1, idx2)
+
+
+def grid_closest_pair(horiz, vert, rng):
+    """
+    Helper function that computes the closest pair of centers stored in arrays
+    with the grid hashing approach of randomized_closest_pair
+
+    Input: horiz and vert are arrays of centers, rng is a NumPy random generator
+
+    Output: tuple of the form (dist, idx1, idx2) where the centers idx1 and idx2
+    have minimum distance dist.
+    """
+    num = len(horiz)
+    if num < 2:
+        return float('inf'), -1, -1
+
+    sample = rng.choice(num, size=max(2, int(num ** (2 / 3))), replace=False)
+    min_dist, idx1, idx2 = array_closest_pair(horiz[sample], vert[sample])
+    idx1, idx2 = int(sample[idx1]), int(sample[idx2])
+    if min_dist == 0:
+        return min_dist, min(idx1, idx2), max(idx1, idx2)
+
+    # shift the cells so that every neighboring cell has a non-negative column and row
+    cols = np.floor(horiz / min_dist)
+    rows = np.floor(vert / min_dist)
+    cols -= cols.min() - 1
+    rows -= rows.min() - 1
+    num_rows = rows.max() + 2
+    if (cols.max() + 2) * num_rows >= 2 ** 62:
+        # the cell keys would overflow, fall back to divide and conquer
+        return array_closest_pair(horiz, vert)
+
+    # hash every center by its cell and group the centers of each cell together
+    keys = cols.astype(np.int64) * int(num_rows) + rows.astype(np.int64)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    positions = np.arange(num)
+    cell_ends = np.searchsorted(sorted_keys, sorted_keys, side='right')
+
+    # pairs in the same cell, then with the cells above and to the right
+    neighbor_offsets = [int(num_rows) - 1, int(num_rows), int(num_rows) + 1, 1]
+    for offset in [None] + neighbor_offsets:
+        if offset is None:
+            starts, ends = positions + 1, cell_ends
+        else:
+            starts = np.searchsorted(sorted_keys, sorted_keys + offset, side='left')
+            ends = np.searchsorted(sorted_keys, sorted_keys + offset, side='right')
+        counts = ends - starts
+        total = int(counts.sum())
+        if instrumentation.ACTIVE_REPORT is not None:
+            instrumentation.ACTIVE_REPORT.count('closest_pair.distances', total)
+        if total == 0:
+            continue
+
+        # expand the position ranges into explicit pairs
+        firsts = np.repeat(positions, counts)
+        seconds = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        firsts, seconds = order[firsts], order[seconds]
+        dists = np.sqrt((vert[firsts] - vert[seconds]) ** 2 + (horiz[firsts] - horiz[seconds]) ** 2)
+        pair_pos = int(np.argmin(dists))
+        if dists[pair_pos] < min_dist:
+            min_dist, idx1, idx2 = float(dists[pair_pos]), int(firsts[pair_pos]), int(seconds[pair_pos])
+
+    return min_dist, min(idx1, idx2), max(idx1, idx2)
+
+
+def squared_distances(points1, points2):
+    """
+    Helper function that computes the squared Euclidean distances between two sets of points
+
+    Input: arrays of points of shapes (n1, d) and (n2, d)
+
+    Output: array of shape (n1, n2)
+    """
+    squares = np.zeros((len(points1), len(points2)))
+    for dim in range(points1.shape[1]):
+        squares += (points1[:, dim, None] - points2[None, :, dim]) ** 2
+    return squares
+
+
+def point_distances(points, idx):
+    """
+    Helper function that computes Euclidean distances from one point to all of them
+
+    Input: array of points of shape (n, d), idx is an integer index
+
+    Output: array whose entry k is the distance between points idx and k
+    """
+    return np.sqrt(squared_distances(points[idx:idx + 1], points)[0])
+
+
+def nearest_neighbor(points, active, idx):
+    """
+    Helper function that finds the closest active point to the point idx
+
+    Input: array of points of shape (n, d), active is a boolean mask of the points
+    still present in the clustering, idx is an integer index
+
+    Output: tuple of the form (dist, nn_idx) where nn_idx is the closest active point
+    to the point idx (other than idx itself) and dist is the distance between them
+    """
+    dists = point_distances(points, idx)
+    dists[~active] = np.inf
+    dists[idx] = np.inf
+    nn_idx = int(np.argmin(dists))
+    return float(dists[nn_idx]), nn_idx
+
+
+def all_nearest_neighbors(points):
+    """
+    Helper function that finds the closest point to every point in a set
+
+    Input: array of points of shape (n, d)
+
+    Output: tuple of arrays (nn_dist, nn_idx) where nn_idx[k] is the closest point to
+    the point k and nn_dist[k] is the distance between them
+    """
+    num = len(points)
+    nn_dist = np.full(num, np.inf)
+    nn_idx = np.full(num, -1, dtype=np.intp)
+    block = max(1, DIST_BLOCK_SIZE // max(num, 1))
+
+    # scan the pairwise distance matrix in row blocks to keep memory bounded
+    for start in range(0, num, block):
+        stop = min(start + block, num)
+        rows = np.arange(stop - start)
+        dists = np.sqrt(squared_distances(points[start:stop], points))
+        dists[rows, rows + start] = np.inf
+        nn_idx[start:stop] = np.argmin(dists, axis=1)
+        nn_dist[start:stop] = dists[rows, nn_idx[start:stop]]
+
+    return nn_dist, nn_idx
+
+
+def merge_nearest_points(points, num_clusters, merge):
+    """
+    Helper generator that repeatedly merges the closest pair of points
+    Note: the function mutates points
+
+    Every point keeps track of its nearest neighbor, and a heap ordered by these
+    distances yields the closest pair, so only the points affected by a merge
+    are rescanned instead of recomputing the closest pair from scratch.
+
+    Input: array of points of shape (n, d), integer number of points left when merging stops,
+    function merge(idx1, idx2) that merges the closest points idx1 and idx2, stores the position
+    of the merged point in points and returns the tuple (kept_idx, removed_idx) of its index
+    and of the index of the point it absorbed
+    Output: yields a tuple of the form (dist, kept_idx, removed_idx) after each merge,
+    where dist is the distance between the two points before the merge
+    """
+    num_active = len(points)
+    if num_active <= max(num_clusters, 1):
+        return
+
+    report = instrumentation.ACTIVE_REPORT
+    active = np.ones(num_active, dtype=bool)
+    with instrumentation.phase('hierarchical.initial_neighbors'):
+        nn_dist, nn_idx = all_nearest_neighbors(points)
+    if report is not None:
+        report.count('hierarchical.distances', num_active * num_active)
+
+    # the heap may hold outdated entries, which are skipped when popped
+    heap = [(dist, idx) for idx, dist in enumerate(nn_dist.tolist())]
+    heapq.heapify(heap)
+
+    while num_active > max(num_clusters, 1):
+        dist, idx1 = heapq.heappop(heap)
+        if not active[idx1] or dist != nn_dist[idx1]:
+            if report is not None:
+                report.count('hierarchical.outdated_heap_entries')
+            continue
+        merge_start = time.perf_counter() if report is not None else 0.0
+        idx1, idx2 = merge(idx1, int(nn_idx[idx1]))
+        active[idx2] = False
+        num_active -= 1
+
+        dists = point_distances(points, idx1)
+        dists[~active] = np.inf
+        dists[idx1] = np.inf
+
+        # points that are now closer to the merged point than to their neighbor
+        closer = dists < nn_dist
+        # points whose neighbor has moved or disappeared need a full rescan
+        stale = active & ~closer & ((nn_idx == idx1) | (nn_idx == idx2))
+        stale[idx1] = False
+
+        for idx in np.flatnonzero(closer).tolist():
+            nn_dist[idx] = dists[idx]
+            nn_idx[idx] = idx1
+            heapq.heappush(heap, (nn_dist[idx], idx))
+        for idx in np.flatnonzero(stale).tolist():
+            nn_dist[idx], nn_idx[idx] = nearest_neighbor(points, active, idx)
+            heapq.heappush(heap, (nn_dist[idx], idx))
+
+        nn_idx[idx1] = int(np.argmin(dists))
+        nn_dist[idx1] = dists[nn_idx[idx1]]
+        heapq.heappush(heap, (nn_dist[idx1], idx1))
+
+        if report is not None:
+            num_rescans = int(np.count_nonzero(stale))
+            report.count('hierarchical.merges')
+            report.count('hierarchical.rescans', num_rescans)
+            report.count('hierarchical.distances', (num_rescans + 1) * len(points))
+            report.append('hierarchical.merge_seconds', time.perf_counter() - merge_start)
+        yield float(dist), idx1, idx2
+
+
+def merge_closest_pairs(cluster_list, num_clusters, spatial_index=False):
+    """
+    Helper generator that repeatedly merges the closest pair of clusters in a list
+    Note: the function mutates the clusters in cluster_list, but not the list itself
+
+    The closest pairs of centers are found with the nearest neighbor heap of
+    merge_nearest_points, or, with spatial_index set, searched in a GridIndex.
+
+    Input: List of clusters, integer number of clusters left when merging stops
+    Output: yields a tuple of the form (dist, idx1, idx2) after each merge, where
+    cluster_list[idx2] was merged into cluster_list[idx1] and dist is the distance
+    between their centers before the merge
+    """
+    if len(cluster_list) <= max(num_clusters, 1):
+        return
+    if spatial_index:
+        yield from indexed_merge_closest_pairs(cluster_list, num_clusters)
+        return
+
+    points = np.array([[cluster.horiz_center(), cluster.vert_center()] for cluster in cluster_list],
+                      dtype=float).reshape(len(cluster_list), 2)
+
+    def merge(idx1, idx2):
+        """
+        Merge two clusters and store the center of the merged one
+        """
+        # keep the cluster on the left, as merging a sorted list would
+        if points[idx2, 0] < points[idx1, 0]:
+            idx1, idx2 = idx2, idx1
+        cluster_list[idx1].merge_clusters(cluster_list[idx2])
+        points[idx1] = cluster_list[idx1].horiz_center(), cluster_list[idx1].vert_center()
+        return idx1, idx2
+
+    yield from merge_nearest_points(points, num_clusters, merge)
+
+
+def indexed_merge_closest_pairs(cluster_list, num_clusters):
+    """
+    Helper generator with the same contract as merge_closest_pairs that searches
+    the nearest neighbors in a GridIndex over the cluster centers, which is updated
+    incrementally after every merge
+
+    A cluster caches its nearest neighbor among the clusters present at its last scan.
+    Any newer cluster has scanned it, so the smallest cached distance is always the
+    distance of the closest pair, and only the merged cluster and the clusters whose
+    neighbor moved or disappeared have to be rescanned.
+    """
+    num_active = len(cluster_list)
+    index = GridIndex.from_points([cluster.horiz_center() for cluster in cluster_list],
+                                  [cluster.vert_center() for cluster in cluster_list])
+    active = [True] * num_active
+    nn_dist, nn_idx = [float('inf')] * num_active, [-1] * num_active
+    # clusters whose cached nearest neighbor is a given cluster
+    neighbor_of = [set() for _ in range(num_active)]
+
+    def rescan(idx):
+        """
+        Search the nearest neighbor of cluster idx and push it to the heap
+        """
+        nn_dist[idx], nn_idx[idx] = index.nearest(*index.position(idx), exclude=idx)
+        if report is not None:
+            report.count('hierarchical.rescans')
+        if nn_idx[idx] is not None:
+            neighbor_of[nn_idx[idx]].add(idx)
+            heapq.heappush(heap, (nn_dist[idx], idx))
+
+    report = instrumentation.ACTIVE_REPORT
+    heap = []
+    with instrumentation.phase('hierarchical.initial_neighbors'):
+        for idx in range(num_active):
+            rescan(idx)
+
+    while num_active > max(num_clusters, 1):
+        dist, idx1 = heapq.heappop(heap)
+        if not active[idx1] or dist != nn_dist[idx1]:
+            if report is not None:
+                report.count('hierarchical.outdated_heap_entries')
+            continue
+        merge_start = time.perf_counter() if report is not None else 0.0
+        idx2 = nn_idx[idx1]
+        # keep the cluster on the left, as merging a sorted list would
+        if cluster_list[idx2].horiz_center() < cluster_list[idx1].horiz_center():
+            idx1, idx2 = idx2, idx1
+
+        cluster_list[idx1].merge_clusters(cluster_list[idx2])
+        active[idx2] = False
+        num_active -= 1
+        index.delete(idx2)
+        index.insert(idx1, cluster_list[idx1].horiz_center(), cluster_list[idx1].vert_center())
+
+        neighbor_of[nn_idx[idx2]].discard(idx2)
+        neighbor_of[nn_idx[idx1]].discard(idx1)
+        stale = (neighbor_of[idx1] | neighbor_of[idx2] | {idx1}) - {idx2}
+        neighbor_of[idx1], neighbor_of[idx2] = set(), set()
+        for idx in stale:
+            rescan(idx)
+
+        if report is not None:
+            report.count('hierarchical.merges')
+            report.append('hierarchical.merge_seconds', time.perf_counter() - merge_start)
+        yield dist, idx1, idx2
+
+
+def hierarchical_clustering(cluster_list, num_clusters, *_, spatial_index=False):
     """
     Compute a hierarchical clustering of a set of clusters
     Note: the function mutates cluster_list
     
-    Input: List of clusters, integer number of clusters
-    Output: List of clusters whose length is num_clusters
+    Input: List of clusters (or a ClusterSet, which is left unchanged), integer number of clusters,
+    optionally whether to search the closest pairs with a spatial index
+    Output: List of clusters whose length is num_clusters (sorted by horizontal center),
+    or a new ClusterSet holding them for a ClusterSet input
     """
-    while len(cluster_list) > num_clusters:
-        cluster_list.sort(key = lambda cluster: cluster.horiz_center())
-        _, idx1, idx2 = fast_closest_pair(cluster_list)
+    if isinstance(cluster_list, alg_cluster.ClusterSet):
+        # merge the rows of a copy holding only the active clusters, so row indices match positions
+        cluster_set = cluster_list.compact()
+        with instrumentation.phase('hierarchical'):
+            for _ in merge_closest_pairs(cluster_set, num_clusters, spatial_index):
+                pass
+        return cluster_set.compact()
 
-        cluster1, cluster2 = cluster_list[idx1], cluster_list[idx2]
-        cluster1.merge_clusters(cluster2)
-        cluster_list.remove(cluster2)
+    merged_idxs = set()
+    with instrumentation.phase('hierarchical'):
+        for _, _, idx2 in merge_closest_pairs(cluster_list, num_clusters, spatial_index):
+            merged_idxs.add(idx2)
 
+    cluster_list[:] = sorted((cluster for idx, cluster in enumerate(cluster_list) if idx not in merged_idxs),
+                             key = lambda cluster: cluster.horiz_center())
     return cluster_list
 
 
-def kmeans_clustering(cluster_list, num_clusters, num_iterations):
+class MergeHistory:
+    """
+    Class for recording every merge of a hierarchical clustering run down to a single cluster
+
+    The initial clusters are the nodes 0 .. num_leaves - 1 and the merge number t
+    creates the node num_leaves + t, which allows to rebuild the clustering for
+    any number of clusters without running the algorithm again.
+    """
+
+    def __init__(self, cluster_list, leaf_errors=None):
+        """
+        Create an empty history whose leaves are copies of the clusters in cluster_list
+        leaf_errors are the errors of the initial clusters (zero for singleton clusters)
+        """
+        self._leaves = [cluster.copy() for cluster in cluster_list]
+        self._merges = []
+        self._error_sums = [sum(leaf_errors) if leaf_errors is not None else 0.0]
+
+
+    def __len__(self):
+        """
+        Get the number of recorded merges
+        """
+        return len(self._merges)
+
+    def num_leaves(self):
+        """
+        Get the number of initial clusters
+        """
+        return len(self._leaves)
+
+    def merges(self):
+        """
+        Get the list of merges as tuples of the form
+        (node1, node2, dist, horiz_center, vert_center, total_population, averaged_risk)
+        describing the merged nodes, the distance between their centers and the new cluster
+        """
+        return self._merges
+
+    def add_merge(self, node1, node2, dist, merged_cluster):
+        """
+        Record the merge of the nodes node1 and node2 whose centers lie at distance dist
+        into merged_cluster and return the id of the new node
+        """
+        pop1, pop2 = self._node_population(node1), self._node_population(node2)
+        self._merges.append((node1, node2, dist, merged_cluster.horiz_center(), merged_cluster.vert_center(),
+                             merged_cluster.total_population(), merged_cluster.averaged_risk()))
+
+        # merging two clusters increases the total error by the weighted squared distance of their centers
+        error_increase = pop1 * pop2 / (pop1 + pop2) * dist ** 2 if pop1 + pop2 else 0.0
+        self._error_sums.append(self._error_sums[-1] + error_increase)
+        return len(self._leaves) + len(self._merges) - 1
+
+    def _node_population(self, node):
+        """
+        Get the total population of the cluster represented by a node
+        """
+        if node < len(self._leaves):
+            return self._leaves[node].total_population()
+        return self._merges[node - len(self._leaves)][5]
+
+    def _num_merges(self, num_clusters):
+        """
+        Get the number of merges that produce num_clusters clusters
+        """
+        num_clusters = min(max(num_clusters, 1), len(self._leaves))
+        num_merges = len(self._leaves) - num_clusters
+        if num_merges > len(self._merges):
+            raise ValueError(f'The history does not reach {num_clusters} clusters')
+        return num_merges
+
+    def clusters(self, num_clusters):
+        """
+        Rebuild the clustering with num_clusters clusters
+
+        Output: List of new clusters sorted by horizontal center
+        """
+        num_leaves = len(self._leaves)
+        num_merges = self._num_merges(num_clusters)
+
+        # point every merged node at the node it was merged into
+        parent = list(range(num_leaves + num_merges))
+        for merge_idx, (node1, node2, *_) in enumerate(self._merges[ :num_merges]):
+            parent[node1] = parent[node2] = num_leaves + merge_idx
+
+        # compute the root of every node, starting from the newest nodes
+        for node in range(num_leaves + num_merges - 1, -1, -1):
+            parent[node] = parent[parent[node]]
+
+        members, moments = {}, {}
+        for leaf in range(num_leaves):
+            members.setdefault(parent[leaf], set()).update(self._leaves[leaf].fips_codes())
+            moments[parent[leaf]] = alg_cluster.add_moments(moments.get(parent[leaf], (0, 0.0, 0.0, 0.0)),
+                                                            self._leaves[leaf].moments())
+
+        cluster_list = []
+        for root, fips_codes in members.items():
+            if root < num_leaves:
+                leaf = self._leaves[root]
+                cluster_list.append(alg_cluster.Cluster(fips_codes, leaf.horiz_center(), leaf.vert_center(),
+                                                        leaf.total_population(), leaf.averaged_risk(),
+                                                        moments[root]))
+            else:
+                cluster_list.append(alg_cluster.Cluster(fips_codes, *self._merges[root - num_leaves][3: ],
+                                                        moments=moments[root]))
+
+        return sorted(cluster_list, key = lambda cluster: cluster.horiz_center())
+
+    def distortion(self, num_clusters):
+        """
+        Get the total error of the clustering with num_clusters clusters
+        """
+        return self._error_sums[self._num_merges(num_clusters)]
+
+
+def hierarchical_merge_history(cluster_list, data_table=None, spatial_index=False):
+    """
+    Compute a hierarchical clustering of a set of clusters down to a single cluster
+    recording every merge. Unlike hierarchical_clustering, cluster_list is not mutated.
+
+    Input: List of clusters, optionally the data table used to create the clusters
+    (only needed to compute the errors of initial clusters of several counties whose
+    moments are unknown; a ValueError is raised if such a cluster has no data table)
+    and whether to search the closest pairs with a spatial index
+    Output: MergeHistory object
+    """
+    leaf_errors = []
+    for cluster in cluster_list:
+        if data_table is None and cluster.moments() is None:
+            if cluster.num_counties() > 1:
+                raise ValueError('A data table is needed to compute the error of a cluster '
+                                 'of several counties whose moments are unknown')
+            # a cluster of at most one county lies at its center
+            leaf_errors.append(0.0)
+        else:
+            leaf_errors.append(cluster.cluster_error(data_table))
+    history = MergeHistory(cluster_list, leaf_errors)
+
+    # compact clusters merge their counties without copying sets of FIPS codes
+    clusters = [alg_cluster.CompactCluster.from_cluster(cluster) for cluster in cluster_list]
+    nodes = list(range(len(clusters)))
+    for dist, idx1, idx2 in merge_closest_pairs(clusters, 1, spatial_index):
+        nodes[idx1] = history.add_merge(nodes[idx1], nodes[idx2], dist, clusters[idx1])
+
+    return history
+
+
+def nearest_centers(points, centers):
+    """
+    Helper function that assigns every point to its closest center
+
+    Input: arrays of points and centers of shapes (n, d) and (k, d)
+
+    Output: array whose entry i is the index of the closest center to point i
+    """
+    num = len(points)
+    labels = np.empty(num, dtype=np.intp)
+    block = max(1, DIST_BLOCK_SIZE // max(len(centers), 1))
+    for start in range(0, num, block):
+        stop = min(start + block, num)
+        labels[start:stop] = np.argmin(np.sqrt(squared_distances(points[start:stop], centers)), axis=1)
+    return labels
+
+
+def indexed_nearest_centers(points, centers):
+    """
+    Helper function like nearest_centers for 2D points
+    that searches the closest centers in a GridIndex over the centers
+
+    Output: tuple of the form (labels, computed) where labels is the array returned by
+    nearest_centers and computed is the number of distances the index computed
+    """
+    index = GridIndex.from_points(centers[:, 0], centers[:, 1])
+    labels = np.array([index.nearest(horiz_pos, vert_pos)[1] for horiz_pos, vert_pos in points.tolist()],
+                      dtype=np.intp)
+    return labels, index.distances_computed()
+
+
+def two_nearest_centers(horiz, vert, center_horiz, center_vert):
+    """
+    Helper function that finds the two closest centers to every point
+
+    Input: horiz and vert are arrays of points, center_horiz and center_vert are arrays of centers
+
+    Output: tuple of arrays (labels, first_dist, second_dist) where labels[k] is the index
+    of the closest center to point k, first_dist[k] is the distance to it and
+    second_dist[k] is the distance to the second closest center (inf for a single center)
+    """
+    num = len(horiz)
+    labels = np.empty(num, dtype=np.intp)
+    first_dist, second_dist = np.full(num, np.inf), np.full(num, np.inf)
+    block = max(1, DIST_BLOCK_SIZE // max(len(center_horiz), 1))
+    for start in range(0, num, block):
+        stop = min(start + block, num)
+        rows = np.arange(stop - start)
+        vert_dist = vert[start:stop, None] - center_vert[None, :]
+        horiz_dist = horiz[start:stop, None] - center_horiz[None, :]
+        dists = np.sqrt(vert_dist ** 2 + horiz_dist ** 2)
+        labels[start:stop] = np.argmin(dists, axis=1)
+        first_dist[start:stop] = dists[rows, labels[start:stop]]
+        if dists.shape[1] > 1:
+            dists[rows, labels[start:stop]] = np.inf
+            second_dist[start:stop] = dists.min(axis=1)
+    return labels, first_dist, second_dist
+
+
+class HamerlyAssignment:
+    """
+    Class for assigning points to their closest centers over successive k-means iterations
+    using Hamerly's bounds
+
+    Every point keeps an upper bound on the distance to its assigned center and a lower
+    bound on the distance to any other center. A point whose upper bound is below both
+    its lower bound and half the distance from its center to the closest other center
+    provably keeps its assignment, so its distances are not computed at all.
+    """
+
+    def __init__(self, horiz, vert):
+        """
+        Create an assignment state for the points stored in arrays horiz and vert
+        """
+        self._horiz = horiz
+        self._vert = vert
+        self._labels = None
+        self._upper = None
+        self._lower = None
+        self._center_horiz = None
+        self._center_vert = None
+        self._computed = 0
+        self._avoided = 0
+
+
+    def distances_computed(self):
+        """
+        Get the number of point-to-center distances computed so far
+        """
+        return self._computed
+
+    def distances_avoided(self):
+        """
+        Get the number of point-to-center distances a full assignment step would have
+        computed but the bounds made unnecessary
+        """
+        return self._avoided
+
+    def assign(self, center_horiz, center_vert):
+        """
+        Assign every point to its closest center and return the array of assignments
+        (the same array as nearest_centers returns for these centers)
+        """
+        num_points, num_centers = len(self._horiz), len(center_horiz)
+        if self._labels is None:
+            self._labels, self._upper, self._lower = two_nearest_centers(self._horiz, self._vert,
+                                                                         center_horiz, center_vert)
+            self._computed += num_points * num_centers
+            self._center_horiz, self._center_vert = center_horiz, center_vert
+            return self._labels.copy()
+
+        # loosen the bounds by the distances the centers have moved
+        moves = np.sqrt((self._center_vert - center_vert) ** 2 + (self._center_horiz - center_horiz) ** 2)
+        self._center_horiz, self._center_vert = center_horiz, center_vert
+        self._upper += moves[self._labels]
+        if num_centers > 1:
+            farthest = int(np.argmax(moves))
+            largest_moves = np.full(num_centers, moves[farthest])
+            largest_moves[farthest] = np.max(np.delete(moves, farthest))
+            self._lower -= largest_moves[self._labels]
+
+        # half the distance from every center to the closest other center
+        center_dists = np.sqrt((center_vert[:, None] - center_vert[None, :]) ** 2 +
+                               (center_horiz[:, None] - center_horiz[None, :]) ** 2)
+        np.fill_diagonal(center_dists, np.inf)
+        half_gaps = center_dists.min(axis=1) / 2
+        bounds = np.maximum(half_gaps[self._labels], self._lower)
+
+        # tighten the upper bounds of the points that might have changed clusters
+        candidates = np.flatnonzero(self._upper * (1 + BOUND_TOLERANCE) >= bounds)
+        num_tightened = len(candidates)
+        labels = self._labels[candidates]
+        self._upper[candidates] = np.sqrt((self._vert[candidates] - center_vert[labels]) ** 2 +
+                                          (self._horiz[candidates] - center_horiz[labels]) ** 2)
+        candidates = candidates[self._upper[candidates] * (1 + BOUND_TOLERANCE) >= bounds[candidates]]
+
+        # compute all the distances only for the points whose bounds still overlap
+        new_labels, upper, lower = two_nearest_centers(self._horiz[candidates], self._vert[candidates],
+                                                       center_horiz, center_vert)
+        self._labels[candidates] = new_labels
+        self._upper[candidates] = upper
+        self._lower[candidates] = lower
+
+        computed = num_tightened + len(candidates) * num_centers
+        self._computed += computed
+        self._avoided += num_points * num_centers - computed
+        return self._labels.copy()
+
+
+def kmeans_arrays(horiz, vert, population, risk, num_clusters, num_iterations, accelerated=False, stats=None,
+                  spatial_index=False):
+    """
+    Helper function that computes the k-means clustering of points stored in arrays
+
+    Every iteration assigns all the points to their closest centers at once and
+    updates the population-weighted centers with a single pass over the points.
+    The iterations stop early once the assignment of the points stops changing,
+    as every further iteration would reproduce the same centers.
+
+    With accelerated set, the assignment step uses Hamerly's bounds to skip distance
+    computations that cannot change an assignment; the result is the same. If stats is
+    a dictionary, the numbers of distances computed and avoided are added to its
+    'distances_computed' and 'distances_avoided' entries. Otherwise, with spatial_index
+    set, the closest centers are searched in a GridIndex over the centers. The grid
+    computes far fewer distances, but searches them one point at a time in Python, so it
+    is slower than the default vectorized assignment (about 6.5 times at 20000 points and
+    100 clusters); the distances it computes are counted like those of the other paths.
+
+    Input: arrays of horizontal and vertical positions, populations and risks of the points,
+    integers number of clusters and (maximum) number of iterations
+    Output: tuple of the form (assignment, center_horiz, center_vert, center_pop, center_risk)
+    where assignment[k] is the cluster of point k (-1 if it was not assigned to any cluster)
+    """
+    population = np.asarray(population, dtype=float)
+
+    # position initial clusters at the location of points with largest populations
+    initial = np.argsort(-population, kind='stable')[ :num_clusters]
+    num_centers = len(initial)
+    center_horiz, center_vert = horiz[initial], vert[initial]
+    center_pop, center_risk = population[initial], risk[initial]
+    assignment = np.full(len(horiz), -1, dtype=np.intp)
+    assignment[initial] = np.arange(num_centers)
+
+    # weighted sums of every point, accumulated per cluster by a single bincount
+    features = np.column_stack([population, population * horiz, population * vert, population * risk])
+    feature_idxs = np.arange(features.shape[1])
+
+    report = instrumentation.ACTIVE_REPORT
+    points = np.column_stack((horiz, vert))
+    assigner = HamerlyAssignment(horiz, vert) if accelerated else None
+    computed = 0
+    for _ in range(num_iterations):
+        if report is not None:
+            report.count('kmeans.iterations')
+        with instrumentation.phase('kmeans.assign'):
+            if assigner is not None:
+                new_assignment = assigner.assign(center_horiz, center_vert)
+            elif spatial_index:
+                new_assignment, num_computed = indexed_nearest_centers(
+                    points, np.column_stack((center_horiz, center_vert)))
+                computed += num_computed
+            else:
+                new_assignment = nearest_centers(points, np.column_stack((center_horiz, center_vert)))
+                computed += len(horiz) * num_centers
+        if np.array_equal(new_assignment, assignment):
+            if report is not None:
+                report.count('kmeans.converged')
+            break
+        assignment = new_assignment
+
+        with instrumentation.phase('kmeans.update'):
+            sums = np.bincount((assignment[:, None] * features.shape[1] + feature_idxs).ravel(),
+                               weights=features.ravel(), minlength=num_centers * features.shape[1])
+            sums = sums.reshape(num_centers, features.shape[1])
+            center_pop = sums[:, 0]
+            # empty clusters stay at the origin, as new clusters used to
+            weights = np.where(center_pop > 0, center_pop, 1)
+            center_horiz, center_vert = sums[:, 1] / weights, sums[:, 2] / weights
+            center_risk = sums[:, 3] / weights
+
+    if assigner is not None:
+        computed = assigner.distances_computed()
+    avoided = assigner.distances_avoided() if assigner is not None else 0
+    if stats is not None:
+        stats['distances_computed'] = stats.get('distances_computed', 0) + computed
+        stats['distances_avoided'] = stats.get('distances_avoided', 0) + avoided
+    if report is not None:
+        report.count('kmeans.runs')
+        report.count('kmeans.distances', computed)
+        report.count('kmeans.distances_avoided', avoided)
+
+    return assignment, center_horiz, center_vert, center_pop, center_risk
+
+
+def kmeans_cluster_set(cluster_set, num_clusters, num_iterations, accelerated=False, stats=None,
+                       spatial_index=False):
+    """
+    Compute the k-means clustering of the active clusters of a ClusterSet
+    directly on its arrays
+
+    Input: ClusterSet, integers number of clusters and number of iterations,
+    accelerated, stats and spatial_index options as in kmeans_arrays
+    Output: new ClusterSet with num_clusters rows holding the counties of cluster_set
+    """
+    rows = cluster_set.active_rows()
+    assignment, center_horiz, center_vert, center_pop, center_risk = kmeans_arrays(
+        cluster_set.horiz_centers()[rows], cluster_set.vert_centers()[rows],
+        cluster_set.total_populations()[rows], cluster_set.averaged_risks()[rows],
+        num_clusters, num_iterations, accelerated, stats, spatial_index)
+
+    # relabel the counties of the input set with their new clusters
+    positions = np.full(len(cluster_set) + 1, -1, dtype=np.intp)
+    positions[rows] = np.arange(len(rows))
+    labels = np.append(assignment, -1)[positions[cluster_set.labels()]]
+    return alg_cluster.ClusterSet(center_horiz, center_vert, np.rint(center_pop), center_risk,
+                                  cluster_set.fips_codes(), labels)
+
+
+def kmeans_clustering(cluster_list, num_clusters, num_iterations, accelerated=False, stats=None,
+                      spatial_index=False):
     """
     Compute the k-means clustering of a set of clusters
+    Stops before num_iterations once the clustering has converged
     
-    Input: List of clusters, integers number of clusters and number of iterations
-    Output: List of clusters whose length is num_clusters
-    """
-
-    # position initial clusters at the location of clusters with largest populations
-    old_clusters = sorted(cluster_list, key = lambda cluster: cluster.total_population(), reverse=True)[ :num_clusters]
-    for _ in range (num_iterations):
-        new_clusters = []
-        for _ in range (num_clusters):
-            new_clusters.append(alg_cluster.Cluster(set([]), 0, 0, 0, 0))
-        for county in cluster_list:
-            min_dist = float('inf')
-            for idx, cluster in enumerate(old_clusters):
-                curr_dist = county.distance(cluster)
-                if curr_dist < min_dist:
-                    min_dist = curr_dist
-                    closest_cluster_idx = idx
-            new_clusters[closest_cluster_idx].merge_clusters(county)
-        old_clusters = list(new_clusters)
-
-    return old_clusters
+    Input: List of clusters (or a ClusterSet), integers number of clusters and number of iterations,
+    optionally the accelerated and spatial_index flags and a stats dictionary (see kmeans_arrays)
+    Output: List of clusters whose length is num_clusters (a ClusterSet for a ClusterSet input)
+    """
+    if isinstance(cluster_list, alg_cluster.ClusterSet):
+        return kmeans_cluster_set(cluster_list, num_clusters, num_iterations, accelerated, stats, spatial_index)
+
+    assignment, center_horiz, center_vert, center_pop, center_risk = kmeans_arrays(
+        np.array([cluster.horiz_center() for cluster in cluster_list], dtype=float),
+        np.array([cluster.vert_center() for cluster in cluster_list], dtype=float),
+        np.array([cluster.total_population() for cluster in cluster_list], dtype=float),
+        np.array([cluster.averaged_risk() for cluster in cluster_list], dtype=float),
+        num_clusters, num_iterations, accelerated, stats, spatial_index)
+
+    members = [set() for _ in range(len(center_horiz))]
+    moments = [(0, 0.0, 0.0, 0.0)] * len(center_horiz)
+    for cluster, cluster_idx in zip(cluster_list, assignment.tolist()):
+        if cluster_idx >= 0:
+            members[cluster_idx].update(cluster.fips_codes())
+            moments[cluster_idx] = alg_cluster.add_moments(moments[cluster_idx], cluster.moments())
+
+    return [alg_cluster.Cluster(members[idx], float(center_horiz[idx]), float(center_vert[idx]),
+                                int(round(center_pop[idx])), float(center_risk[idx]), moments[idx])
+            for idx in range(len(center_horiz))]
+
 
+def stream_rows(row_source):
+    """
+    Helper function that starts a pass over a source of data table rows
+
+    Input: row_source is either a function returning a new iterable of rows
+    [fips_code, horiz, vert, population, risk] on every call (such as a generator
+    function reading a file, e.g. lambda: iter_data_table(path)), or a collection of rows
+    that can be iterated repeatedly; a one-shot iterator such as a generator raises a TypeError,
+    as the passes after the first one would see no rows
+    Output: iterator over the rows
+    """
+    if callable(row_source):
+        return iter(row_source())
+    rows = iter(row_source)
+    if rows is row_source:
+        raise TypeError('Expected a function returning the rows or a re-iterable collection, '
+                        f'got a one-shot iterator {type(row_source).__name__}')
+    return rows
+
+
+def row_batches(rows, batch_size, sample_fraction=1.0, rng=None):
+    """
+    Helper generator that groups a stream of data table rows into batches of arrays,
+    keeping every row with probability sample_fraction
+
+    Input: iterable of rows, integer batch size, sampling fraction and NumPy random generator
+    Output: yields tuples of the form (fips_codes, horiz, vert, population, risk)
+    holding at most batch_size rows
+    """
+    batch = []
+    for row in rows:
+        if sample_fraction < 1 and rng.random() >= sample_fraction:
+            continue
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch_arrays(batch)
+            batch = []
+    if batch:
+        yield batch_arrays(batch)
+
+
+def batch_arrays(batch):
+    """
+    Helper function that converts a list of data table rows into a tuple of arrays
+    (fips_codes, horiz, vert, population, risk)
+    """
+    fips_codes, horiz, vert, population, risk = zip(*batch)
+    return (list(fips_codes), np.array(horiz, dtype=float), np.array(vert, dtype=float),
+            np.array(population, dtype=float), np.array(risk, dtype=float))
+
+
+def minibatch_kmeans(row_source, num_clusters, batch_size=4096, num_epochs=1, sample_fraction=1.0,
+                     seed=None, keep_members=False):
+    """
+    Compute a k-means clustering of a stream of counties too large to hold in memory
+
+    The centers start at the counties with largest populations (found in a first pass).
+    Each training batch is assigned to its closest centers, and every center moves
+    towards the population-weighted mean of its batch counties with a rate equal to
+    their share of all the population assigned to it so far, so it tracks the weighted
+    mean of every county it has seen. A final pass assigns every county to the trained
+    centers and accumulates the clusters. Memory is bounded by the batch size
+    (plus the FIPS codes of the clusters when keep_members is set).
+
+    Input: row_source as in stream_rows, integers number of clusters and rows per batch,
+    number of training passes over the stream, fraction of the rows sampled into the training
+    batches, random seed, and whether to collect the FIPS codes of the clusters
+    Output: List of clusters whose length is num_clusters; their moments are always set,
+    so their errors can be computed without the data table
+    """
+    rng = np.random.default_rng(seed)
+
+    # position initial clusters at the location of counties with largest populations
+    initial = heapq.nlargest(num_clusters, stream_rows(row_source), key = lambda row: row[3])
+    num_centers = len(initial)
+    center_horiz = np.array([row[1] for row in initial], dtype=float)
+    center_vert = np.array([row[2] for row in initial], dtype=float)
+    seen_pop = np.zeros(num_centers)
+
+    for _ in range(num_epochs):
+        for _, horiz, vert, population, _ in row_batches(stream_rows(row_source), batch_size, sample_fraction, rng):
+            labels = nearest_centers(np.column_stack((horiz, vert)), np.column_stack((center_horiz, center_vert)))
+            batch_pop = np.bincount(labels, weights=population, minlength=num_centers)
+            updated = batch_pop > 0
+            seen_pop += batch_pop
+            rates = np.where(updated, batch_pop / np.where(seen_pop > 0, seen_pop, 1), 0)
+            weights = np.where(updated, batch_pop, 1)
+            batch_horiz = np.bincount(labels, weights=population * horiz, minlength=num_centers) / weights
+            batch_vert = np.bincount(labels, weights=population * vert, minlength=num_centers) / weights
+            center_horiz += rates * (batch_horiz - center_horiz)
+            center_vert += rates * (batch_vert - center_vert)
+
+    # final assignment pass accumulating the population-weighted sums of every cluster
+    sums = np.zeros((5, num_centers))
+    members = [set() for _ in range(num_centers)]
+    for fips_codes, horiz, vert, population, risk in row_batches(stream_rows(row_source), batch_size):
+        labels = nearest_centers(np.column_stack((horiz, vert)), np.column_stack((center_horiz, center_vert)))
+        for row, values in enumerate([population, population * horiz, population * vert,
+                                      population * (horiz ** 2 + vert ** 2), population * risk]):
+            sums[row] += np.bincount(labels, weights=values, minlength=num_centers)
+        if keep_members:
+            for fips_code, label in zip(fips_codes, labels.tolist()):
+                members[label].add(fips_code)
+
+    cluster_list = []
+    for idx in range(num_centers):
+        pop_sum, horiz_sum, vert_sum, square_sum, risk_sum = sums[:, idx].tolist()
+        if pop_sum > 0:
+            horiz_pos, vert_pos, risk = horiz_sum / pop_sum, vert_sum / pop_sum, risk_sum / pop_sum
+        else:
+            horiz_pos, vert_pos, risk = float(center_horiz[idx]), float(center_vert[idx]), 0.0
+        cluster_list.append(alg_cluster.Cluster(members[idx], horiz_pos, vert_pos, int(round(pop_sum)), risk,
+                                                (pop_sum, horiz_sum, vert_sum, square_sum)))
+    return cluster_list
@@ -0,0 +1,162 @@
+"""
+Memoization of clustering results
+
+Results are keyed by the content hash of the data table (see data_cache),
+the clustering algorithm, the number of clusters and the number of iterations.
+They are kept in memory with least recently used eviction and, optionally,
+pickled to a directory so that later runs can reuse them.
+"""
+
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+import data_cache
+
+DEFAULT_MAX_ENTRIES = 32
+
+# marker of a lookup that found no result (a result may be None)
+_MISSING = object()
+
+
+def dataset_hash(data_table):
+    """
+    Compute the content hash of a data table
+    """
+    return data_cache.content_hash(data_cache.table_columns(data_table))
+
+
+class ClusteringCache:
+    """
+    Class for memoizing clustering results in memory (LRU) and optionally on disk
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, cache_dir=None):
+        """
+        Create a cache holding at most max_entries results in memory,
+        also storing them in cache_dir unless it is None
+        """
+        if max_entries < 1:
+            raise ValueError(f'Invalid number of entries provided = {max_entries}')
+
+        self._max_entries = max_entries
+        self._cache_dir = cache_dir
+        self._entries = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+
+    def __len__(self):
+        """
+        Get the number of results held in memory
+        """
+        return len(self._entries)
+
+    def cache_dir(self):
+        """
+        Get the directory results are stored in (None if they are only kept in memory)
+        """
+        return self._cache_dir
+
+    def hits(self):
+        """
+        Get the number of lookups answered from the cache
+        """
+        return self._hits
+
+    def misses(self):
+        """
+        Get the number of lookups that had to compute their result
+        """
+        return self._misses
+
+
+    def _path(self, key):
+        """
+        Get the file a result is stored in on disk
+        """
+        return os.path.join(self._cache_dir, hashlib.sha256(repr(key).encode('utf-8')).hexdigest() + '.pickle')
+
+    def get(self, key, default=None):
+        """
+        Get the result stored for a key (default if there is none)
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        if self._cache_dir is not None:
+            try:
+                with open(self._path(key), 'rb') as result_file:
+                    stored_key, value = pickle.load(result_file)
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+                return default
+            if stored_key == key:
+                self._remember(key, value)
+                return value
+        return default
+
+    def put(self, key, value):
+        """
+        Store the result for a key
+        """
+        self._remember(key, value)
+        if self._cache_dir is not None:
+            # write into a temporary file first, so a stored result is never partial
+            os.makedirs(self._cache_dir, exist_ok=True)
+            file_desc, temp_path = tempfile.mkstemp(dir=self._cache_dir, suffix='.pickle')
+            with os.fdopen(file_desc, 'wb') as result_file:
+                pickle.dump((key, value), result_file)
+            os.replace(temp_path, self._path(key))
+
+    def _remember(self, key, value):
+        """
+        Keep a result in memory, evicting the least recently used one if the cache is full
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Forget the results held in memory (results on disk are kept)
+        """
+        self._entries.clear()
+
+    def get_or_compute(self, key, compute):
+        """
+        Get the result stored for a key, computing it with compute() and storing it if there is none
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self._hits += 1
+            return value
+        self._misses += 1
+        value = compute()
+        self.put(key, value)
+        return value
+
+
+# cache used when no other one is given
+DEFAULT_RESULT_CACHE = ClusteringCache()
+
+
+def cached_clustering(data_table, algorithm, num_clusters, num_iterations, compute, result_cache=None,
+                      data_hash=None):
+    """
+    Get a clustering of a data table through a result cache
+
+    Input: data table, name of the clustering algorithm, number of clusters, number of
+    iterations (None if the algorithm has none), function computing the list of clusters,
+    optionally a ClusteringCache (DEFAULT_RESULT_CACHE by default) and the content hash
+    of the data table (computed if not given)
+    Output: list of copies of the clusters, which the caller may mutate
+    """
+    if result_cache is None:
+        result_cache = DEFAULT_RESULT_CACHE
+    if data_hash is None:
+        data_hash = dataset_hash(data_table)
+
+    cluster_list = result_cache.get_or_compute((data_hash, algorithm, num_clusters, num_iterations), compute)
+    return [cluster.copy() for cluster in cluster_list]
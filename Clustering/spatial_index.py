@@ -0,0 +1,286 @@
+"""
+Spatial index over 2D points (such as cluster centers) based on a uniform grid,
+supporting nearest neighbor, k-nearest neighbors and radius queries
+as well as insertion and deletion of points
+"""
+
+import heapq
+import math
+
+
+class GridIndex:
+    """
+    Class for indexing points by the cell of a uniform grid they fall into
+
+    Queries scan the cells in square rings of growing size around the query point
+    and stop as soon as no unvisited cell can hold a closer point. Points are
+    identified by hashable ids; ties in distance are broken by the smaller id.
+    """
+
+    def __init__(self, cell_size):
+        """
+        Create an empty index whose cells are squares with side cell_size
+        """
+        if cell_size <= 0:
+            raise ValueError(f'Invalid cell size provided = {cell_size}')
+
+        self._cell_size = float(cell_size)
+        self._cells = {}
+        self._points = {}
+        self._bounds = None
+        self._build_size = 0
+        self._distances_computed = 0
+
+    @classmethod
+    def from_points(cls, horiz, vert, ids=None):
+        """
+        Create an index holding the points (horiz[k], vert[k]) with ids ids[k]
+        (k by default), choosing the cell size so that a cell holds about one point
+        """
+        horiz, vert = [float(pos) for pos in horiz], [float(pos) for pos in vert]
+        if ids is None:
+            ids = range(len(horiz))
+        index = cls(cls._fit_cell_size(horiz, vert))
+        for item_id, horiz_pos, vert_pos in zip(ids, horiz, vert):
+            index.insert(item_id, horiz_pos, vert_pos)
+        return index
+
+    @staticmethod
+    def _fit_cell_size(horiz, vert):
+        """
+        Compute a cell size giving about one point per cell over the bounding box of the points,
+        but no smaller than the size giving one point per cell along its longest side
+        (so nearly collinear points do not spread over almost empty cells)
+        """
+        if len(horiz) < 2:
+            return 1.0
+        width = max(horiz) - min(horiz)
+        height = max(vert) - min(vert)
+        area = max(width * height, max(width, height) ** 2 / len(horiz))
+        if area <= 0:
+            return 1.0
+        return math.sqrt(area / len(horiz))
+
+
+    def __len__(self):
+        """
+        Get the number of indexed points
+        """
+        return len(self._points)
+
+    def __contains__(self, item_id):
+        """
+        Check whether a point with the given id is indexed
+        """
+        return item_id in self._points
+
+    def cell_size(self):
+        """
+        Get the side of the grid cells
+        """
+        return self._cell_size
+
+    def distances_computed(self):
+        """
+        Get the number of point distances computed by the queries so far
+        """
+        return self._distances_computed
+
+    def position(self, item_id):
+        """
+        Get the position (horiz, vert) of an indexed point
+        """
+        return self._points[item_id]
+
+
+    def _cell(self, horiz_pos, vert_pos):
+        """
+        Get the cell containing a position
+        """
+        return math.floor(horiz_pos / self._cell_size), math.floor(vert_pos / self._cell_size)
+
+    def insert(self, item_id, horiz_pos, vert_pos):
+        """
+        Add a point to the index (an indexed point with the same id is moved)
+        """
+        if item_id in self._points:
+            self.delete(item_id)
+        horiz_pos, vert_pos = float(horiz_pos), float(vert_pos)
+        cell = self._cell(horiz_pos, vert_pos)
+        self._points[item_id] = (horiz_pos, vert_pos)
+        self._cells.setdefault(cell, {})[item_id] = (horiz_pos, vert_pos)
+        self._build_size = max(self._build_size, len(self._points))
+
+        # the bounds of the occupied cells limit how far the queries expand
+        if self._bounds is None:
+            self._bounds = [cell[0], cell[0], cell[1], cell[1]]
+        else:
+            self._bounds = [min(self._bounds[0], cell[0]), max(self._bounds[1], cell[0]),
+                            min(self._bounds[2], cell[1]), max(self._bounds[3], cell[1])]
+
+    def delete(self, item_id):
+        """
+        Remove a point from the index
+        """
+        horiz_pos, vert_pos = self._points.pop(item_id)
+        cell = self._cell(horiz_pos, vert_pos)
+        del self._cells[cell][item_id]
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+        # coarsen the grid once most of the points are gone to keep the cells populated
+        if 0 < len(self._points) < self._build_size // 4:
+            self._rebuild(self._cell_size * 2)
+
+    def _rebuild(self, cell_size):
+        """
+        Redistribute the indexed points over a grid with a new cell size
+        """
+        points = self._points
+        self._cell_size = cell_size
+        self._cells, self._points, self._bounds = {}, {}, None
+        for item_id, (horiz_pos, vert_pos) in points.items():
+            self.insert(item_id, horiz_pos, vert_pos)
+        self._build_size = len(self._points)
+
+
+    def _max_ring(self, cell):
+        """
+        Get the largest ring around a cell that can contain indexed points
+        """
+        if self._bounds is None:
+            return -1
+        min_col, max_col, min_row, max_row = self._bounds
+        return max(abs(cell[0] - min_col), abs(cell[0] - max_col),
+                   abs(cell[1] - min_row), abs(cell[1] - max_row))
+
+    def _ring_cells(self, cell, ring):
+        """
+        Generate the cells at Chebyshev distance ring from a cell
+        """
+        col, row = cell
+        if ring == 0:
+            yield cell
+            return
+        for dcol in range(-ring, ring + 1):
+            yield col + dcol, row - ring
+            yield col + dcol, row + ring
+        for drow in range(-ring + 1, ring):
+            yield col - ring, row + drow
+            yield col + ring, row + drow
+
+    def _query_cells(self, cell, ring):
+        """
+        Get the cells a query around a cell scans at a ring, and whether they are the last ones:
+        once a ring has more cells than are occupied, all the occupied cells at least
+        that far are scanned at once instead of walking mostly empty rings
+        """
+        if 8 * ring <= len(self._cells):
+            return self._ring_cells(cell, ring), False
+        col, row = cell
+        return [other for other in self._cells if max(abs(other[0] - col), abs(other[1] - row)) >= ring], True
+
+    def k_nearest(self, horiz_pos, vert_pos, num_neighbors, exclude=None):
+        """
+        Find the num_neighbors closest indexed points to a position
+        (ignoring the point with id exclude)
+
+        Returns a list of tuples (dist, item_id) sorted by distance
+        """
+        cell = self._cell(horiz_pos, vert_pos)
+        max_ring = self._max_ring(cell)
+        # max-heap (by negated distance) of the best points found so far
+        best = []
+        ring = 0
+        while ring <= max_ring:
+            ring_cells, is_last = self._query_cells(cell, ring)
+            for ring_cell in ring_cells:
+                cell_points = self._cells.get(ring_cell, {})
+                self._distances_computed += len(cell_points) - (exclude in cell_points)
+                for item_id, (point_horiz, point_vert) in cell_points.items():
+                    if item_id == exclude:
+                        continue
+                    dist = math.sqrt((vert_pos - point_vert) ** 2 + (horiz_pos - point_horiz) ** 2)
+                    entry = (-dist, _ReversedId(item_id))
+                    if len(best) < num_neighbors:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+            # points outside the scanned rings lie at least ring * cell_size away
+            if is_last or len(best) == num_neighbors and -best[0][0] < ring * self._cell_size:
+                break
+            ring += 1
+
+        return sorted((-neg_dist, wrapped.item_id) for neg_dist, wrapped in best)
+
+    def nearest(self, horiz_pos, vert_pos, exclude=None):
+        """
+        Find the closest indexed point to a position (ignoring the point with id exclude)
+
+        Returns a tuple (dist, item_id), or (inf, None) if there is no such point
+        """
+        cell = self._cell(horiz_pos, vert_pos)
+        max_ring = self._max_ring(cell)
+        best_dist, best_id = float('inf'), None
+        ring = 0
+        while ring <= max_ring:
+            ring_cells, is_last = self._query_cells(cell, ring)
+            for ring_cell in ring_cells:
+                cell_points = self._cells.get(ring_cell, {})
+                self._distances_computed += len(cell_points) - (exclude in cell_points)
+                for item_id, (point_horiz, point_vert) in cell_points.items():
+                    if item_id == exclude:
+                        continue
+                    dist = math.sqrt((vert_pos - point_vert) ** 2 + (horiz_pos - point_horiz) ** 2)
+                    if dist < best_dist or (dist == best_dist and item_id < best_id):
+                        best_dist, best_id = dist, item_id
+            # points outside the scanned rings lie at least ring * cell_size away
+            if is_last or best_dist < ring * self._cell_size:
+                break
+            ring += 1
+
+        return best_dist, best_id
+
+    def within_radius(self, horiz_pos, vert_pos, radius):
+        """
+        Find all the indexed points whose distance to a position is at most radius
+
+        Returns a list of tuples (dist, item_id) sorted by distance
+        """
+        if not self._points:
+            return []
+        min_col, min_row = self._cell(horiz_pos - radius, vert_pos - radius)
+        max_col, max_row = self._cell(horiz_pos + radius, vert_pos + radius)
+        min_col, max_col = max(min_col, self._bounds[0]), min(max_col, self._bounds[1])
+        min_row, max_row = max(min_row, self._bounds[2]), min(max_row, self._bounds[3])
+
+        found = []
+        for col in range(min_col, max_col + 1):
+            for row in range(min_row, max_row + 1):
+                cell_points = self._cells.get((col, row), {})
+                self._distances_computed += len(cell_points)
+                for item_id, (point_horiz, point_vert) in cell_points.items():
+                    dist = math.sqrt((vert_pos - point_vert) ** 2 + (horiz_pos - point_horiz) ** 2)
+                    if dist <= radius:
+                        found.append((dist, item_id))
+        return sorted(found)
+
+
+class _ReversedId:
+    """
+    Wrapper inverting the order of ids, so that on equal distances
+    the max-heap of k_nearest evicts the larger id first
+    """
+    __slots__ = ('item_id',)
+
+    def __init__(self, item_id):
+        self.item_id = item_id
+
+    def __lt__(self, other):
+        return other.item_id < self.item_id
+
+    def __gt__(self, other):
+        return other.item_id > self.item_id
+
+    def __eq__(self, other):
+        return self.item_id == other.item_id
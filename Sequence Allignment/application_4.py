@@ -5,10 +5,19 @@ as well as implementing a spelling correction based on the edit distance concept
 import math
 import random
 import urllib.request
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import matplotlib.pyplot as plt
+import numpy as np
 import project_4 as helper_module
 
+# number of trials of every task of the null distribution; the shuffles of a task only depend
+# on the master seed and on the position of the task, so this is fixed for results to reproduce
+TRIALS_PER_TASK = 100
+
+# sequences and scoring matrix of the null distribution, set in every process by (init_null_worker)
+NULL_STATE = {}
+
 
 def read_scoring_matrix(filename):
     """
@@ -19,6 +28,7 @@ def read_scoring_matrix(filename):
 
     Returns:
     A dictionary of dictionaries mapping X and Y characters to scores
+    (as a compiled, read-only helper_module.ScoringMatrix)
     """
     scoring_dict = {}
     scoring_file = urllib.request.urlopen(filename)
@@ -32,7 +42,7 @@ def read_scoring_matrix(filename):
         scoring_dict[xkey] = {}
         for ykey, val in zip(ykeychars, vals):
             scoring_dict[xkey][ykey] = int(val)
-    return scoring_dict
+    return helper_module.ScoringMatrix(scoring_dict)
 
 
 def read_protein(filename):
@@ -69,27 +79,87 @@ def read_words(filename):
     return word_list
 
 
-def generate_null_distribution(seq_x, seq_y, scoring_matrix, num_trials):
+def init_null_worker(seq_x, seq_y, scoring_matrix):
+    """
+    Prepares a process for running null distribution tasks:
+    compiles (scoring_matrix) and stores the encoded sequences.
+    """
+    scoring_matrix = helper_module.compile_scoring_matrix(scoring_matrix)
+    NULL_STATE['scoring_matrix'] = scoring_matrix
+    NULL_STATE['codes_x'] = scoring_matrix.encode(seq_x)
+    NULL_STATE['codes_y'] = scoring_matrix.encode(seq_y)
+
+
+def null_distribution_task(seed_seq, num_trials):
+    """
+    Runs (num_trials) trials of the null distribution, shuffling the second sequence
+    with a generator seeded by (seed_seq), a numpy.random.SeedSequence.
+
+    Returns the dictionary of the number of occurencies of every score.
+    """
+    rng = np.random.default_rng(seed_seq)
+    codes_x, codes_y, scoring_matrix = NULL_STATE['codes_x'], NULL_STATE['codes_y'], NULL_STATE['scoring_matrix']
+    scoring_distribution = {}
+    for _ in range(num_trials):
+        score = helper_module.local_alignment_score(codes_x, rng.permutation(codes_y), scoring_matrix)[0]
+        scoring_distribution[score] = scoring_distribution.get(score, 0) + 1
+    return scoring_distribution
+
+
+def print_null_progress(trials_done, num_trials):
+    """
+    Prints the number of trials of the null distribution done so far on a single updated line.
+    """
+    print(f"\rNull distribution: {trials_done} of {num_trials} trials", end="\n" if trials_done == num_trials else "", flush=True)
+
+
+def generate_null_distribution(seq_x, seq_y, scoring_matrix, num_trials, seed=None, max_workers=None,
+                               progress=print_null_progress):
     """
     Computes the null distribution of scores between two sequences
     by shuffling one of them (num_trials) times and calculating the score
     of local alignment for each trial.
+    The trials are split into tasks of TRIALS_PER_TASK trials run by a pool of (max_workers) processes
+    (one per core by default, in the current process if it is 1). The shuffles of every task are seeded
+    from the master (seed), so the same (seed) gives the same distribution with any number of workers
+    (a fresh one is drawn if it is None). After every task, (progress) is called with the numbers of trials
+    done and of all trials, unless it is None.
 
     Returns a dictinary with keys corresponding to score values and values
     to the number of occurencies of the particular score.
     """
+    if num_trials < 0:
+        raise ValueError(f'Invalid number of trials provided = {num_trials}')
+
+    seed_seqs = np.random.SeedSequence(seed).spawn(math.ceil(num_trials / TRIALS_PER_TASK))
+    tasks = [(seed_seq, min(TRIALS_PER_TASK, num_trials - idx * TRIALS_PER_TASK))
+             for idx, seed_seq in enumerate(seed_seqs)]
     scoring_distribution = {}
-    for _ in range(num_trials):
-        rand_y = list(seq_y)
-        random.shuffle(rand_y)
-        align_m = helper_module.compute_alignment_matrix(seq_x, rand_y, scoring_matrix, False)
-        score = helper_module.compute_local_alignment(seq_x, rand_y, scoring_matrix, align_m)[0]
-        if score in scoring_distribution:
-            scoring_distribution[score] += 1
-        else:
-            scoring_distribution[score] = 1
-    
-    return scoring_distribution
+    trials_done = 0
+
+    def merge(task_distribution, task_trials):
+        """
+        Adds the scores of a task to the distribution and reports the progress.
+        """
+        nonlocal trials_done
+        for score, count in task_distribution.items():
+            scoring_distribution[score] = scoring_distribution.get(score, 0) + count
+        trials_done += task_trials
+        if progress is not None:
+            progress(trials_done, num_trials)
+
+    if max_workers == 1:
+        init_null_worker(seq_x, seq_y, scoring_matrix)
+        for task in tasks:
+            merge(null_distribution_task(*task), task[1])
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_null_worker,
+                                 initargs=(seq_x, seq_y, scoring_matrix)) as executor:
+            futures = {executor.submit(null_distribution_task, *task): task[1] for task in tasks}
+            for future in as_completed(futures):
+                merge(future.result(), futures[future])
+
+    return dict(sorted(scoring_distribution.items()))
 
 
 def plot_distribution(dist, num_trials):
@@ -3,11 +3,136 @@ This module contains functions for measuring the similarity between two sequence
 It uses dynamic programming for computing an alignment table based on the values of their scoring matrix.
 """
 
+from types import MappingProxyType
+
+import numpy as np
+
+# smallest average number of cells per anti-diagonal of a table computed one anti-diagonal
+# at a time with NumPy; tables with shorter diagonals are faster to compute cell by cell
+ARRAY_MIN_DIAGONAL_CELLS = 80
+
+# number of plain dictionaries whose compiled ScoringMatrix is kept by compile_scoring_matrix
+COMPILED_CACHE_SIZE = 8
+_COMPILED_MATRICES = {}
+
+
+class ScoringMatrix(dict):
+    """
+    A scoring matrix compiled for alignment: a read-only dictionary of dictionaries of scores
+    (accepted anywhere the plain form is) whose characters, the alphabet plus '-',
+    are also mapped to small integers indexing a dense 2D NumPy array of the scores.
+    As the scores are compiled when the object is created, modifying it raises a TypeError;
+    to change scores, build a new one from a modified copy (see to_dict).
+    """
+
+    def __init__(self, scoring_matrix):
+        """
+        Takes as input a (scoring_matrix) given as a dictionary of dictionaries.
+        """
+        super().__init__((char, MappingProxyType(dict(row))) for char, row in scoring_matrix.items())
+        chars = sorted(self)
+        self._char_index = {char : idx for idx, char in enumerate(chars)}
+        values = [[self[char_1][char_2] for char_2 in chars] for char_1 in chars]
+        is_integer = all(isinstance(value, int) for row in values for value in row)
+        self._scores = np.array(values, dtype=np.int64 if is_integer else float).reshape(len(chars), len(chars))
+        self._score_rows = self._scores.tolist()
+
+    def _read_only(self, *_args, **_kwargs):
+        """
+        Rejects any modification of the matrix.
+        """
+        raise TypeError("ScoringMatrix is read-only; build a new one from a modified to_dict() copy")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        """
+        Pickles the matrix by its scores (its rows cannot be pickled as they are).
+        """
+        return type(self), (self.to_dict(),)
+
+    def to_dict(self):
+        """
+        Returns the scores as a new (modifiable) dictionary of dictionaries.
+        """
+        return {char : dict(row) for char, row in self.items()}
+
+    def char_index(self):
+        """
+        Returns the dictionary mapping every character of the matrix to its integer.
+        """
+        return self._char_index
+
+    def dash_index(self):
+        """
+        Returns the integer of '-'.
+        """
+        return self._char_index["-"]
+
+    def scores(self):
+        """
+        Returns the dense 2D NumPy array of the scores indexed by the integers of the characters
+        (of integers if every score is an integer).
+        """
+        return self._scores
+
+    def score_rows(self):
+        """
+        Returns the scores as a list of lists of Python numbers, for fast lookups of single cells.
+        """
+        return self._score_rows
+
+    def encode(self, seq):
+        """
+        Takes as input a sequence (seq) of characters of the matrix.
+        Returns the NumPy array of the integers of its characters.
+        A sequence that is already encoded (an integer NumPy array) is returned unchanged.
+        """
+        if isinstance(seq, np.ndarray) and seq.dtype.kind in "iu":
+            return seq
+        return np.array(self.encode_list(seq), dtype=np.intp)
+
+    def encode_list(self, seq):
+        """
+        Takes as input a sequence (seq) of characters of the matrix.
+        Returns the list of the integers of its characters (for cell by cell computations).
+        """
+        char_index = self._char_index
+        try:
+            return [char_index[char] for char in seq]
+        except KeyError as error:
+            raise ValueError(f"Character {error.args[0]!r} is not in the scoring matrix") from None
+
+
+def compile_scoring_matrix(scoring_matrix):
+    """
+    Takes as input a (scoring_matrix) given as a dictionary of dictionaries or as a ScoringMatrix.
+    Returns it as a ScoringMatrix (compiled only if it is not one already).
+    The last few dictionaries compiled are remembered by identity, so passing the same one
+    again to the alignment functions does not compile it again; a dictionary is therefore
+    treated as read-only once compiled (modify a copy instead, or compile it with ScoringMatrix).
+    """
+    if isinstance(scoring_matrix, ScoringMatrix):
+        return scoring_matrix
+    key = id(scoring_matrix)
+    cached = _COMPILED_MATRICES.get(key)
+    # the cache holds on to the dictionary, so its id cannot be reused by another object
+    if cached is not None and cached[0] is scoring_matrix:
+        return cached[1]
+    compiled = ScoringMatrix(scoring_matrix)
+    _COMPILED_MATRICES.pop(key, None)
+    if len(_COMPILED_MATRICES) >= COMPILED_CACHE_SIZE:
+        del _COMPILED_MATRICES[next(iter(_COMPILED_MATRICES))]
+    _COMPILED_MATRICES[key] = scoring_matrix, compiled
+    return compiled
+
 
 def build_scoring_matrix(alphabet, diag_score, off_diag_score, dash_score):
     """
     Takes as input a set of characters (alphabet) and three score values. 
-    Returns a dictionary of dictionaries whose entries are indexed by pairs of characters in (alphabet) plus '-'.
+    Returns a dictionary of dictionaries whose entries are indexed by pairs of characters in (alphabet) plus '-'
+    (as a compiled, read-only ScoringMatrix).
     Every cell in the matrix is scored based on its position.
     The score for any entry indexed by one or more dashes is always (dash_score). 
     """
@@ -25,7 +150,78 @@ def build_scoring_matrix(alphabet, diag_score, off_diag_score, dash_score):
 
             scoring_matrix[matrix_row][matrix_col] = score
 
-    return scoring_matrix
+    return ScoringMatrix(scoring_matrix)
+
+
+def alignment_matrix_array(seq_x, seq_y, scoring_matrix, global_flag):
+    """
+    Takes the same input as (compute_alignment_matrix).
+    Returns the dynamic programming table as a 2D NumPy array.
+    The cells of an anti-diagonal (row + col constant) only depend on the two previous
+    anti-diagonals, so each anti-diagonal is computed at once, with the same additions
+    and comparisons per cell as the cell by cell computation.
+    """
+    scoring_matrix = compile_scoring_matrix(scoring_matrix)
+    scores = scoring_matrix.scores()
+    codes_x, codes_y = scoring_matrix.encode(seq_x), scoring_matrix.encode(seq_y)
+    dash = scoring_matrix.dash_index()
+    num_rows, num_cols = len(seq_x), len(seq_y)
+    align_matrix = np.zeros((num_rows + 1, num_cols + 1), dtype=scores.dtype)
+
+    # the first row and column only extend gaps
+    for row in range(1, num_rows + 1):
+        score = align_matrix[row - 1, 0] + scores[codes_x[row - 1], dash]
+        align_matrix[row, 0] = score if global_flag or score > 0 else 0
+    for col in range(1, num_cols + 1):
+        score = align_matrix[0, col - 1] + scores[dash, codes_y[col - 1]]
+        align_matrix[0, col] = score if global_flag or score > 0 else 0
+
+    x_gaps, y_gaps = scores[codes_x, dash], scores[dash, codes_y]
+    for diag in range(2, num_rows + num_cols + 1):
+        rows = np.arange(max(1, diag - num_cols), min(num_rows, diag - 1) + 1)
+        cols = diag - rows
+        up = align_matrix[rows - 1, cols] + x_gaps[rows - 1]
+        left = align_matrix[rows, cols - 1] + y_gaps[cols - 1]
+        diagonal = align_matrix[rows - 1, cols - 1] + scores[codes_x[rows - 1], codes_y[cols - 1]]
+        score = np.maximum(np.maximum(up, left), diagonal)
+        if not global_flag:
+            score = np.maximum(score, 0)
+        align_matrix[rows, cols] = score
+
+    return align_matrix
+
+
+def alignment_matrix_lists(seq_x, seq_y, scoring_matrix, global_flag):
+    """
+    Takes the same input as (compute_alignment_matrix).
+    Returns the dynamic programming table as a list of lists, computed cell by cell
+    with indexed lookups of the scores.
+    """
+    scoring_matrix = compile_scoring_matrix(scoring_matrix)
+    score_rows = scoring_matrix.score_rows()
+    dash = scoring_matrix.dash_index()
+    codes_y = scoring_matrix.encode_list(seq_y)
+    y_gaps = [score_rows[dash][code_y] for code_y in codes_y]
+
+    align_row = [0]
+    for y_gap in y_gaps:
+        score = align_row[-1] + y_gap
+        align_row.append(score if global_flag or score >= 0 else 0)
+    align_matrix = [align_row]
+
+    for code_x in scoring_matrix.encode_list(seq_x):
+        x_scores = score_rows[code_x]
+        x_gap = x_scores[dash]
+        previous_row = align_row
+        score = previous_row[0] + x_gap
+        align_row = [score if global_flag or score >= 0 else 0]
+        for col, code_y in enumerate(codes_y):
+            score = max(previous_row[col + 1] + x_gap, align_row[col] + y_gaps[col],
+                        previous_row[col] + x_scores[code_y])
+            align_row.append(score if global_flag or score >= 0 else 0)
+        align_matrix.append(align_row)
+
+    return align_matrix
 
 
 def compute_alignment_matrix(seq_x, seq_y, scoring_matrix, global_flag):
@@ -34,31 +230,13 @@ def compute_alignment_matrix(seq_x, seq_y, scoring_matrix, global_flag):
     Returns a list of lists representing the dynamic programming table for these sequences. 
     If (global_flag) is "True", each entry of the table is computed for global allignment.
     Otherwise the local allignment computation method is used.
+    Tables whose anti-diagonals hold at least ARRAY_MIN_DIAGONAL_CELLS cells on average are computed
+    one anti-diagonal at a time (see alignment_matrix_array), others cell by cell (see alignment_matrix_lists).
     """
-    rows = range(len(seq_x) + 1)
-    cols = range(len(seq_y) + 1)
-
-    align_matrix = []
-    for row in rows:
-        align_matrix.append([])
-        for col in cols:
-            if row == 0 and col == 0:
-                score = 0
-            elif row == 0 and col > 0:
-                score = align_matrix[0][col - 1] + scoring_matrix["-"][seq_y[col - 1]]
-            elif row > 0 and col == 0:
-                score = align_matrix[row - 1][0] + scoring_matrix[seq_x[row - 1]]["-"]
-            else:
-                up = align_matrix[row - 1][col] + scoring_matrix[seq_x[row - 1]]["-"]
-                left = align_matrix[row][col - 1] + scoring_matrix["-"][seq_y[col - 1]]
-                diagonal = align_matrix[row - 1][col - 1] + scoring_matrix[seq_x[row - 1]][seq_y[col - 1]]
-                score = max(up, left, diagonal)
-            if not global_flag:
-                if score < 0:
-                    score = 0
-            align_matrix[row].append(score)
-
-    return align_matrix
+    num_cells = len(seq_x) * len(seq_y)
+    if num_cells < ARRAY_MIN_DIAGONAL_CELLS * (len(seq_x) + len(seq_y) + 1):
+        return alignment_matrix_lists(seq_x, seq_y, scoring_matrix, global_flag)
+    return alignment_matrix_array(seq_x, seq_y, scoring_matrix, global_flag).tolist()
 
 
 def compute_global_alignment(seq_x, seq_y, scoring_matrix, alignment_matrix):
@@ -67,17 +245,21 @@ def compute_global_alignment(seq_x, seq_y, scoring_matrix, alignment_matrix):
     a common alphabet with the (scoring matrix). 
     Computes a global alignment of the sequences using the global (alignment matrix).
     """
+    scoring_matrix = compile_scoring_matrix(scoring_matrix)
+    score_rows = scoring_matrix.score_rows()
+    dash_row = score_rows[scoring_matrix.dash_index()]
+    codes_x, codes_y = scoring_matrix.encode_list(seq_x), scoring_matrix.encode_list(seq_y)
     score = alignment_matrix[-1][-1]
     row, col = len(seq_x), len(seq_y)
     alig_x, alig_y = "", ""
 
     while row != 0 and col != 0:
-        if alignment_matrix[row][col] == alignment_matrix[row - 1][col - 1] + scoring_matrix[seq_x[row - 1]][seq_y[col - 1]]:
+        if alignment_matrix[row][col] == alignment_matrix[row - 1][col - 1] + score_rows[codes_x[row - 1]][codes_y[col - 1]]:
             alig_x = seq_x[row - 1] + alig_x
             alig_y = seq_y[col - 1] + alig_y
             row -= 1
             col -= 1
-        elif alignment_matrix[row][col] == alignment_matrix[row][col - 1] + scoring_matrix["-"][seq_y[col - 1]]:
+        elif alignment_matrix[row][col] == alignment_matrix[row][col - 1] + dash_row[codes_y[col - 1]]:
             alig_x = "-" + alig_x
             alig_y = seq_y[col - 1] + alig_y
             col -= 1
@@ -104,6 +286,10 @@ def compute_local_alignment(seq_x, seq_y, scoring_matrix, alignment_matrix):
     a common alphabet with the (scoring matrix). 
     Computes a local optimal alignment of the sequences using the local (alignment matrix).
     """
+    scoring_matrix = compile_scoring_matrix(scoring_matrix)
+    score_rows = scoring_matrix.score_rows()
+    dash_row = score_rows[scoring_matrix.dash_index()]
+    codes_x, codes_y = scoring_matrix.encode_list(seq_x), scoring_matrix.encode_list(seq_y)
     alig_x, alig_y = "", ""
     max_score = float("-inf")
 
@@ -115,12 +301,12 @@ def compute_local_alignment(seq_x, seq_y, scoring_matrix, alignment_matrix):
                 col = idx_2
 
     while alignment_matrix[row][col] != 0:
-        if alignment_matrix[row][col] == alignment_matrix[row - 1][col - 1] + scoring_matrix[seq_x[row - 1]][seq_y[col - 1]]:
+        if alignment_matrix[row][col] == alignment_matrix[row - 1][col - 1] + score_rows[codes_x[row - 1]][codes_y[col - 1]]:
             alig_x = seq_x[row - 1] + alig_x
             alig_y = seq_y[col - 1] + alig_y
             row -= 1
             col -= 1
-        elif alignment_matrix[row][col] == alignment_matrix[row][col - 1] + scoring_matrix["-"][seq_y[col - 1]]:
+        elif alignment_matrix[row][col] == alignment_matrix[row][col - 1] + dash_row[codes_y[col - 1]]:
             alig_x = "-" + alig_x
             alig_y = seq_y[col - 1] + alig_y
             col -= 1
@@ -130,3 +316,146 @@ def compute_local_alignment(seq_x, seq_y, scoring_matrix, alignment_matrix):
             row -= 1
 
     return max_score, alig_x, alig_y
+
+
+def alignment_rows(codes_x, codes_y, scoring_matrix, global_flag):
+    """
+    Takes as input two encoded sequences (codes_x) and (codes_y), a compiled (scoring_matrix)
+    and the (global_flag) of (compute_alignment_matrix).
+    Generates the rows of its dynamic programming table as NumPy arrays (which must not be modified),
+    computing each one from the previous one only.
+    With integer scores a row is computed at once from prefix maxima of its cells without horizontal gaps.
+    """
+    scores, dash = scoring_matrix.scores(), scoring_matrix.dash_index()
+    y_gaps = scores[dash, codes_y]
+    gap_sums = np.concatenate(([0], np.cumsum(y_gaps))).astype(scores.dtype)
+    is_integer = scores.dtype.kind == "i"
+
+    def add_gaps(best):
+        """
+        Returns the row whose cells are the best of (best) and of the horizontal gaps from a cell on their left.
+        """
+        if is_integer:
+            return gap_sums + np.maximum.accumulate(best - gap_sums)
+        values, gaps = best.tolist(), y_gaps.tolist()
+        for col in range(1, len(values)):
+            values[col] = max(values[col], values[col - 1] + gaps[col - 1])
+        return np.array(values, dtype=scores.dtype)
+
+    if global_flag:
+        align_row = gap_sums
+    else:
+        align_row = add_gaps(np.zeros(len(codes_y) + 1, dtype=scores.dtype))
+    yield align_row
+
+    for code_x in codes_x:
+        best = align_row + scores[code_x, dash]
+        best[1:] = np.maximum(best[1:], align_row[:-1] + scores[code_x, codes_y])
+        if not global_flag:
+            best = np.maximum(best, 0)
+        align_row = add_gaps(best)
+        yield align_row
+
+
+def global_alignment_score(seq_x, seq_y, scoring_matrix):
+    """
+    Takes as input two sequences (seq_x) and (seq_y) whose elements share
+    a common alphabet with the (scoring matrix).
+    Returns the score of their global alignment (as given by (compute_global_alignment)),
+    keeping only two rows of the dynamic programming table and computing no alignment.
+    """
+    scoring_matrix = compile_scoring_matrix(scoring_matrix)
+    for align_row in alignment_rows(scoring_matrix.encode(seq_x), scoring_matrix.encode(seq_y), scoring_matrix, True):
+        pass
+    return align_row[-1].item()
+
+
+def local_alignment_score(seq_x, seq_y, scoring_matrix):
+    """
+    Takes as input two sequences (seq_x) and (seq_y) whose elements share
+    a common alphabet with the (scoring matrix).
+    Returns a tuple (score, row, col) of the score of their local alignment (as given by (compute_local_alignment))
+    and the cell of the dynamic programming table where it ends, i.e. its alignment ends
+    with seq_x[row - 1] and seq_y[col - 1], keeping only two rows of the table and computing no alignment.
+    """
+    scoring_matrix = compile_scoring_matrix(scoring_matrix)
+    max_score, max_row, max_col = None, 0, 0
+    for row, align_row in enumerate(alignment_rows(scoring_matrix.encode(seq_x), scoring_matrix.encode(seq_y),
+                                                   scoring_matrix, False)):
+        col = int(np.argmax(align_row))
+        if max_score is None or align_row[col] > max_score:
+            max_score, max_row, max_col = align_row[col], row, col
+
+    return max_score.item(), max_row, max_col
+
+
+def global_alignment_crossing(codes_x, codes_y, scoring_matrix, mid_row):
+    """
+    Takes as input two encoded sequences (codes_x) and (codes_y), a compiled (scoring_matrix)
+    and a row (mid_row) with 0 <= mid_row < len(codes_x).
+    Follows where the traceback of (compute_global_alignment) would go from every cell below (mid_row),
+    keeping only two rows of the dynamic programming table (see alignment_rows).
+    Returns a tuple (score, col) of the global alignment score and the column at which that
+    traceback, started from the last cell, first reaches (mid_row).
+    """
+    scores, dash = scoring_matrix.scores(), scoring_matrix.dash_index()
+    cols = np.arange(len(codes_y) + 1)
+    y_gaps = scores[dash, codes_y]
+    previous_row = crossing = None
+
+    for row, align_row in enumerate(alignment_rows(codes_x, codes_y, scoring_matrix, True)):
+        if row > mid_row:
+            # the traceback prefers a diagonal move, then a horizontal one, then a vertical one
+            is_diagonal = np.zeros(len(cols), dtype=bool)
+            is_diagonal[1:] = align_row[1:] == previous_row[:-1] + scores[codes_x[row - 1], codes_y]
+            is_left = np.zeros(len(cols), dtype=bool)
+            is_left[1:] = ~is_diagonal[1:] & (align_row[1:] == align_row[:-1] + y_gaps)
+            if crossing is None:
+                moved = np.where(is_diagonal, cols - 1, cols)
+            else:
+                moved = np.where(is_diagonal, np.roll(crossing, 1), crossing)
+            # a horizontal move leads to the same crossing as the nearest cell on its left that does not move horizontally
+            crossing = moved[np.maximum.accumulate(np.where(is_left, 0, cols))]
+        previous_row = align_row
+
+    return previous_row[-1].item(), int(crossing[-1])
+
+
+def hirschberg_global_alignment(seq_x, seq_y, scoring_matrix, block_size=1024):
+    """
+    Takes as input two sequences (seq_x) and (seq_y) whose elements share
+    a common alphabet with the (scoring matrix).
+    Returns the same global alignment (score, alig_x, alig_y) as (compute_global_alignment)
+    does with the table of (compute_alignment_matrix), using memory linear in the lengths of the sequences.
+    Hirschberg's method: the cell at which the traceback reaches the middle row of the table splits
+    the alignment into two independent smaller ones, until they have at most (block_size) cells
+    and are aligned with the table.
+    With non-integer scores, rounding may break ties between equally scored alignments differently.
+    """
+    scoring_matrix = compile_scoring_matrix(scoring_matrix)
+    codes_x, codes_y = scoring_matrix.encode(seq_x), scoring_matrix.encode(seq_y)
+    alig_x, alig_y = [], []
+
+    def align(row_start, row_end, col_start, col_end):
+        """
+        Appends the alignment of seq_x[row_start:row_end] and seq_y[col_start:col_end]
+        to (alig_x) and (alig_y) and returns its score.
+        """
+        num_rows, num_cols = row_end - row_start, col_end - col_start
+        if num_rows <= 1 or num_rows * num_cols <= block_size:
+            sub_x, sub_y = seq_x[row_start:row_end], seq_y[col_start:col_end]
+            score, sub_alig_x, sub_alig_y = compute_global_alignment(
+                sub_x, sub_y, scoring_matrix, compute_alignment_matrix(sub_x, sub_y, scoring_matrix, True))
+            alig_x.append(sub_alig_x)
+            alig_y.append(sub_alig_y)
+            return score
+
+        mid_row = num_rows // 2
+        score, mid_col = global_alignment_crossing(codes_x[row_start:row_end], codes_y[col_start:col_end],
+                                                   scoring_matrix, mid_row)
+        align(row_start, row_start + mid_row, col_start, col_start + mid_col)
+        align(row_start + mid_row, row_end, col_start + mid_col, col_end)
+        return score
+
+    score = align(0, len(codes_x), 0, len(codes_y))
+    return score, "".join(alig_x), "".join(alig_y)